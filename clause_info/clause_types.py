@@ -92,17 +92,15 @@ def get_annotated_antecedent(ellipsis : Tree) -> Tuple[Tree|None, Tree|None]:
 
 def find_treepath(n1 : Tree, n2 : Tree):
     # find common ancestor
-    ancestors1 = n1.ancestors()
-    ancestors2 = n2.ancestors()
-    progenitor = None
-    for n in ancestors1:
-        if n in ancestors2:
-            progenitor = n
-            break
+    progenitor = n1.common_ancestor(n2)
     if not progenitor: return (None, None)
-    ancestors = [a[:a.index(progenitor)+1] for a in (ancestors1, ancestors2)]
-    # ellipsis_ancestors = ellipsis_ancestors[:ellipsis_ancestors.index(progenitor)+1]
-    # antecedent_ancestors = antecedent_ancestors[:antecedent_ancestors.index(progenitor) + 1]
+    ancestors = []
+    for n in (n1, n2):
+        path = [n]
+        while n is not progenitor:
+            n = n.parent
+            path.append(n)
+        ancestors.append(path)
     return tuple(ancestors)
 
 def is_paranthetic(node : Tree) -> bool:
@@ -6,6 +6,8 @@ import pyconll
 from pyconll.unit.sentence import Sentence
 from pyconll.unit.token import Token
 
+from tree_path.conllu_reader import SentenceIndex
+
 
 def split_conllu_by_doc(conllu_in : str, conllu_out1 : str, conllu_out2 : str, one_in = 4):
     conllu_out1 = open(conllu_out1, 'w', encoding='utf8')
@@ -23,12 +25,16 @@ def split_conllu_by_doc(conllu_in : str, conllu_out1 : str, conllu_out2 : str, o
     conllu_out2.close()
     
 def extract_sentences(conllu_in : str, conllu_out : str, condition : Callable[[Sentence], bool] | List[str]) -> int:
+    """If condition is a list of sentence ids, the sentences are read through the file's SentenceIndex"""
     conllu_out = open(conllu_out, 'w', encoding='utf8')
     if not isinstance(condition, Callable):
-        id_list = condition
-        condition = lambda s : s.id in id_list
+        index = SentenceIndex.for_file(conllu_in)
+        sentences = (s for text in index.texts(index.select(condition)) for s in pyconll.load_from_string(text))
+        condition = lambda s : True
+    else:
+        sentences = pyconll.iter_from_file(conllu_in)
     count = 0
-    for sentence in pyconll.iter_from_file(conllu_in):
+    for sentence in sentences:
         if not sentence: continue
         if condition(sentence):
             conllu_out.write(sentence.conll() + '\n\n')
@@ -37,10 +43,11 @@ def extract_sentences(conllu_in : str, conllu_out : str, condition : Callable[[S
     return count
 
 def sentence_by_id(conllu_filename : str, sent_id : str) -> Sentence|None:
-    for sentence in pyconll.iter_from_file(conllu_filename):
-        if sentence.id == sent_id:
-            return sentence
-    return None
+    index = SentenceIndex.for_file(conllu_filename)
+    text = index.sentence_text(sent_id)
+    if text is None:
+        return None
+    return pyconll.load_from_string(text)[0]
 
 def token_neighbors(sentence : Sentence, token_id : str, toks_before : int, toks_after : int) -> List[Token]:
     tok = sentence[token_id]
@@ -47,7 +47,7 @@ def ccom_plus(cle : Tree, other : Tree) -> bool:
             cle = cle.parent
         else:
             break
-    return cle in other.ancestors()
+    return other.has_ancestor(cle)
 
 def compared_clause_chars(cl1 : Tree, cl2 : Tree, pdoc : ParsedDoc) -> Dict[str, int]:
     char_dict = {k:0 for k in compared}
@@ -101,9 +101,9 @@ def generate_antecedent_candidates(ell_node : Tree, pdoc : ParsedDoc, delta_befo
             ant_node = pdoc.get_node_by_uid(a_uid)
         else:
             ant_node = None
-        index0 = pdoc.index(ell_sent) - delta_before
+        index0 = pdoc.sentence_index(ell_sent) - delta_before
         if index0 < 0: index0 = 0
-        index1 = pdoc.index(ell_sent) + delta_after + 1
+        index1 = pdoc.sentence_index(ell_sent) + delta_after + 1
         if index1 > len(pdoc): index1 = len(pdoc)
         for i in range(index0, index1):
             sentence = pdoc[i]
@@ -3,10 +3,19 @@
 import parglare
 import tree_path.search #import _g, _parser, _grammar, _actions
 from tree_path.search import Search
+from tree_path.planner import Planner, CorpusStatistics
 from tree_path.evaluator import Match, before
 from tree_path.tree import Tree
-from tree_path.conllu import ParsedSentence, search_conllu_files
-from tree_path.parsed_doc import ParsedDoc, iter_docs_from_conll, DocList
+from tree_path.search_set import SearchSet
+from tree_path.interning import Interner, INTERNER
+from tree_path.conllu import ParsedSentence, search_conllu_files, search_conllu_files_parallel, MatchRecord
+from tree_path.inverted_index import InvertedIndex
+from tree_path.signatures import SentenceSignatures
+from tree_path.parsed_doc import ParsedDoc, iter_docs_from_conll, DocList, JsonZipWriter, write_json_zip
+from tree_path.array_sentence import ArraySentence, to_array_doc
+from tree_path.columns import CorpusColumns
+from tree_path.corpus_file import CorpusFile, write_corpus, load_corpus, json_zip_to_corpus, corpus_to_json_zip
+from tree_path.lazy_doc_list import LazyDocList
 
 search._g = parglare.Grammar.from_string(search._grammar)
 search._parser = parglare.Parser(search._g, debug=False, actions=search._actions)
@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+from typing import List, Dict, Iterator, Tuple, Set, Mapping, Sequence, Any
+
+import numpy as np
+
+from tree_path.tree import Tree
+from tree_path.conllu import ParsedSentence
+
+
+class StringTable:
+    """Maps strings to integer codes and back. None is coded -1"""
+    def __init__(self):
+        self.codes : Dict[str, int] = {}
+        self.strings : List[str] = []
+    def code(self, s : str|None) -> int:
+        if s is None: return -1
+        c = self.codes.get(s)
+        if c is None:
+            c = self.codes[s] = len(self.strings)
+            self.strings.append(s)
+        return c
+    def string(self, c : int) -> str|None:
+        return None if c < 0 else self.strings[c]
+    def __len__(self):
+        return len(self.strings)
+
+class FeatureTable:
+    """Maps (feature, value) pairs to bit numbers in the feats bitmask"""
+    def __init__(self):
+        self.bits : Dict[Tuple[str, str], int] = {}
+        self.pairs : List[Tuple[str, str]] = []
+        self.key_bits : Dict[str, List[int]] = {}
+        self._decoded : Dict[Tuple[int], List[Tuple[str, Tuple[str]]]] = {}
+    def bit(self, key : str, value : str) -> int:
+        b = self.bits.get((key, value))
+        if b is None:
+            b = self.bits[(key, value)] = len(self.pairs)
+            self.pairs.append((key, value))
+            self.key_bits.setdefault(key, []).append(b)
+        return b
+    def decode(self, mask : Tuple[int]) -> List[Tuple[str, Tuple[str]]]:
+        """(feature, values) pairs set in mask, sorted by feature. Decoded masks are cached"""
+        decoded = self._decoded.get(mask)
+        if decoded is None:
+            feats : Dict[str, List[str]] = {}
+            for w, word in enumerate(mask):
+                while word:
+                    low = word & -word
+                    key, value = self.pairs[w * 64 + low.bit_length() - 1]
+                    feats.setdefault(key, []).append(value)
+                    word ^= low
+            decoded = self._decoded[mask] = [(k, tuple(feats[k])) for k in sorted(feats, key=str.lower)]
+        return decoded
+    def words(self) -> int:
+        """Number of 64 bit words needed for a mask"""
+        return max(1, (len(self.pairs) + 63) // 64)
+
+STRINGS = StringTable()
+FEATURES = FeatureTable()
+
+# columns of ArraySentence._cols, one row per token in sentence order
+ID, FORM, LEMMA, UPOS, XPOS, DEPREL, HEAD = range(7) # string codes
+PARENT = 7 # row of parent, -1 for root
+CHILD_START, CHILD_COUNT = 8, 9 # slice of _child_rows holding the children
+PREORDER = 10 # row of the i-th node in preorder
+ENTER, EXIT, DEPTH = 11, 12, 13 # subtree is PREORDER[ENTER:EXIT]
+MISC_START, MISC_COUNT = 14, 15 # slice of _misc holding (key, value) code pairs
+_N_COLS = 16
+_STRING_COLS = {'id':ID, 'form':FORM, 'lemma':LEMMA, 'upos':UPOS, 'xpos':XPOS, 'deprel':DEPREL, 'head':HEAD}
+_KEYS = ('deprel', 'deps', 'feats', 'form', 'head', 'id', 'lemma', 'misc', 'upos', 'xpos')
+# misc value codes: >= 0 member of a value set, -1 for Key (no value), -2 for an empty set,
+# <= -3 for a plain string value coded -3 - code
+_NO_VALUE, _EMPTY_SET, _STR_VALUE = -1, -2, -3
+
+
+class _TokenData(Mapping):
+    """Read-only dict-like view of a token, decoded from the sentence columns on access"""
+    __slots__ = ('_sentence', '_row')
+    def __init__(self, sentence : ArraySentence, row : int):
+        self._sentence = sentence
+        self._row = row
+    def get(self, key : str, default=None):
+        s = self._sentence
+        col = _STRING_COLS.get(key)
+        if col is not None:
+            return s._strings.string(int(s._cols[self._row, col]))
+        if key == 'feats':
+            return s._decode_feats(self._row)
+        if key == 'misc':
+            return s._decode_misc(self._row)
+        if key == 'deps':
+            return dict(s._deps.get(self._row, {}))
+        return s._extra.get(self._row, {}).get(key, default)
+    def __getitem__(self, key : str):
+        if key not in self:
+            raise KeyError(key)
+        return self.get(key)
+    def __contains__(self, key):
+        return key in _KEYS or key in self._sentence._extra.get(self._row, {})
+    def __iter__(self) -> Iterator[str]:
+        yield from _KEYS
+        yield from self._sentence._extra.get(self._row, {})
+    def __len__(self):
+        return len(_KEYS) + len(self._sentence._extra.get(self._row, {}))
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class ArrayNode(Tree):
+    """Lightweight view of one token of an ArraySentence, with the Tree reading API.
+    Views are read-only: assign, remove and add_child raise"""
+    __slots__ = ('_sentence', '_row')
+    str_from_conllu = True
+    _child_index = None
+    _preorder = None
+    def __init__(self, sentence : ArraySentence, row : int):
+        self._sentence = sentence
+        self._row = row
+    @property
+    def _data(self) -> _TokenData:
+        return _TokenData(self._sentence, self._row)
+    @property
+    def parent(self) -> ArrayNode|None:
+        p = int(self._sentence._cols[self._row, PARENT])
+        return None if p < 0 else self._sentence.view(p)
+    @property
+    def _children(self) -> List[ArrayNode]:
+        s = self._sentence
+        start, count = s._cols[self._row, CHILD_START], s._cols[self._row, CHILD_COUNT]
+        return [s.view(r) for r in s._child_rows[start:start+count].tolist()]
+    @property
+    def _position(self) -> int:
+        return self._row
+    def children(self) -> List[Tree]:
+        return self._children
+    def traverse(self) -> Iterator[Tree]:
+        return iter(self._subtree(0))
+    def descendants(self) -> List[Tree]:
+        return self._subtree(1)
+    def _subtree(self, skip : int) -> List[ArrayNode]:
+        s = self._sentence
+        enter, exit = s._cols[self._row, ENTER], s._cols[self._row, EXIT]
+        return [s.view(r) for r in s._cols[enter+skip:exit, PREORDER].tolist()]
+    def depth(self) -> int:
+        return int(self._sentence._cols[self._row, DEPTH])
+    def has_ancestor(self, node : Tree) -> bool:
+        if isinstance(node, ArrayNode) and node._sentence is self._sentence:
+            cols = self._sentence._cols
+            return cols[node._row, ENTER] <= cols[self._row, ENTER] < cols[node._row, EXIT]
+        return super().has_ancestor(node)
+    def children_with(self, key : str, values : Set[str]) -> List[Tree]:
+        s = self._sentence
+        start, count = s._cols[self._row, CHILD_START], s._cols[self._row, CHILD_COUNT]
+        if not count:
+            return []
+        codes = {s._strings.codes[v] for v in values if v in s._strings.codes}
+        column = s._cols[:, _STRING_COLS[key]]
+        return [s.view(r) for r in s._child_rows[start:start+count].tolist() if int(column[r]) in codes]
+    def assign(self, path: str | List[str], value: str | Set, create_if_absent : bool = True) -> bool:
+        raise Exception('ArraySentence nodes are read-only')
+    def remove(self, path: str | List[str]) -> bool:
+        raise Exception('ArraySentence nodes are read-only')
+    def add_child(self, child : Tree):
+        raise Exception('ArraySentence nodes are read-only')
+
+
+class ArraySentence(ArrayNode, ParsedSentence):
+    """ParsedSentence stored as NumPy columns: string codes, parent rows and tree structure in one int32 block,
+    feats as bitmasks over (feature, value) pairs, misc as code pairs. The sentence is the view of its root token.
+    Strings and feature pairs are coded through tables shared by all sentences"""
+    def __init__(self, sentence : ParsedSentence, strings : StringTable = None, features : FeatureTable = None):
+        self._strings = strings if strings is not None else STRINGS
+        self._features = features if features is not None else FEATURES
+        self.sent_id = sentence.sent_id
+        self.sent_text = sentence.sent_text
+        self.meta_data = sentence.meta_data
+        self._deps : Dict[int, Dict] = {}
+        self._raw_feats : Dict[int, Dict] = {} # feats that are not a dict of sets
+        self._extra : Dict[int, Dict[str, Any]] = {}
+        nodes = sentence.node_list
+        rows = {id(n):i for i, n in enumerate(nodes)}
+        n_rows = len(nodes)
+        cols = np.zeros((n_rows, _N_COLS), dtype=np.int32)
+        feats = []
+        misc = []
+        child_rows = []
+        for i, node in enumerate(nodes):
+            data = node._data
+            for key, col in _STRING_COLS.items():
+                cols[i, col] = self._strings.code(data.get(key))
+            cols[i, PARENT] = rows[id(node.parent)] if node.parent is not None else -1
+            cols[i, CHILD_START] = len(child_rows)
+            cols[i, CHILD_COUNT] = len(node._children)
+            child_rows.extend(rows[id(c)] for c in node._children)
+            token_feats = data.get('feats') or {}
+            if all(isinstance(v, (set, frozenset)) for v in token_feats.values()):
+                feats.append([self._features.bit(k, v) for k, values in token_feats.items() for v in values])
+            else:
+                feats.append([])
+                self._raw_feats[i] = token_feats
+            cols[i, MISC_START] = len(misc)
+            for k, values in (data.get('misc') or {}).items():
+                if values is None:
+                    misc.append((self._strings.code(k), _NO_VALUE))
+                elif isinstance(values, str):
+                    misc.append((self._strings.code(k), _STR_VALUE - self._strings.code(values)))
+                elif not values:
+                    misc.append((self._strings.code(k), _EMPTY_SET))
+                else:
+                    misc.extend((self._strings.code(k), self._strings.code(v)) for v in values)
+            cols[i, MISC_COUNT] = len(misc) - cols[i, MISC_START]
+            if data.get('deps'):
+                self._deps[i] = data['deps']
+            extra = {k:v for k, v in data.items() if k not in _KEYS}
+            if extra:
+                self._extra[i] = extra
+        for enter, node in enumerate(sentence.traverse()):
+            i = rows[id(node)]
+            cols[enter, PREORDER] = i
+            cols[i, ENTER] = enter
+            cols[i, DEPTH] = 0 if node.parent is None else cols[rows[id(node.parent)], DEPTH] + 1
+        for enter in range(n_rows - 1, -1, -1): # children come after their parent in preorder
+            i = cols[enter, PREORDER]
+            cols[i, EXIT] = enter + 1 + sum(cols[c, EXIT] - cols[c, ENTER]
+                                            for c in child_rows[cols[i, CHILD_START]:cols[i, CHILD_START]+cols[i, CHILD_COUNT]])
+        self._cols = cols
+        self._child_rows = np.array(child_rows, dtype=np.int32)
+        self._misc = np.array(misc, dtype=np.int32).reshape(-1, 2)
+        self._feats = np.zeros((n_rows, self._features.words()), dtype=np.uint64)
+        for i, bits in enumerate(feats):
+            for b in bits:
+                self._feats[i, b // 64] |= np.uint64(1 << (b % 64))
+        self._views : List[ArrayNode|None] = [None] * n_rows
+        self._row = rows[id(sentence)]
+        self._sentence = self
+        self._views[self._row] = self
+        self._id_rows : Dict[str, int]|None = None
+        self.node_list = _NodeList(self)
+        self.node_dict = _NodeDict(self)
+
+    def view(self, row : int) -> ArrayNode:
+        node = self._views[row]
+        if node is None:
+            node = self._views[row] = ArrayNode(self, row)
+        return node
+    def id_rows(self) -> Dict[str, int]:
+        """Row of each token id, built on first use"""
+        if self._id_rows is None:
+            self._id_rows = {self._strings.string(c):row for row, c in enumerate(self._cols[:, ID].tolist())}
+        return self._id_rows
+
+    def _decode_feats(self, row : int) -> Dict[str, Set[str]]:
+        if row in self._raw_feats:
+            return _copy_value(self._raw_feats[row])
+        return {k:set(v) for k, v in self._features.decode(tuple(self._feats[row].tolist()))}
+    def _decode_misc(self, row : int) -> Dict[str, Set[str]|None]:
+        misc : Dict[str, Set[str]|None] = {}
+        start, count = self._cols[row, MISC_START], self._cols[row, MISC_COUNT]
+        for k, v in self._misc[start:start+count].tolist():
+            key = self._strings.string(k)
+            if v == _NO_VALUE:
+                misc[key] = None
+            elif v <= _STR_VALUE:
+                misc[key] = self._strings.string(_STR_VALUE - v)
+            else:
+                values = misc.setdefault(key, set())
+                if v != _EMPTY_SET:
+                    values.add(self._strings.string(v))
+        return misc
+    def feature_mask(self, key : str, values : Set[str]) -> np.ndarray:
+        """Boolean array over tokens, true where feats has key with one of values"""
+        mask = np.zeros(len(self._views), dtype=bool)
+        for v in values:
+            b = self._features.bits.get((key, v))
+            if b is not None and b // 64 < self._feats.shape[1]:
+                mask |= (self._feats[:, b // 64] & np.uint64(1 << (b % 64))) != 0
+        return mask
+
+    def nbytes(self) -> int:
+        """Memory held by the column arrays"""
+        return self._cols.nbytes + self._child_rows.nbytes + self._misc.nbytes + self._feats.nbytes
+
+    def to_parsed_sentence(self) -> ParsedSentence:
+        """Mutable Tree-based copy"""
+        trees = [Tree({k:_copy_value(v) for k, v in n._data.items()}, None, []) for n in self.node_list]
+        for i, node in enumerate(self.node_list):
+            for child in node._children:
+                trees[i].add_child(trees[child._row])
+        return ParsedSentence(trees[self._row], self.sent_id, self.sent_text, self.meta_data)
+
+class _NodeList(Sequence):
+    """node_list of an ArraySentence, making the node views as they are accessed"""
+    __slots__ = ('_sentence',)
+    def __init__(self, sentence : ArraySentence):
+        self._sentence = sentence
+    def __getitem__(self, i : int|slice) -> ArrayNode|List[ArrayNode]:
+        if isinstance(i, slice):
+            return [self._sentence.view(r) for r in range(len(self))[i]]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Node index out of range')
+        return self._sentence.view(i)
+    def __len__(self):
+        return len(self._sentence._views)
+    def __iter__(self) -> Iterator[ArrayNode]:
+        view = self._sentence.view
+        for r in range(len(self)):
+            yield view(r)
+
+class _NodeDict(Mapping):
+    """node_dict of an ArraySentence, over the token id rows"""
+    __slots__ = ('_sentence',)
+    def __init__(self, sentence : ArraySentence):
+        self._sentence = sentence
+    def __getitem__(self, node_id : str) -> ArrayNode:
+        return self._sentence.view(self._sentence.id_rows()[node_id])
+    def __contains__(self, node_id):
+        return node_id in self._sentence.id_rows()
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._sentence.id_rows())
+    def __len__(self):
+        return len(self._sentence._views)
+
+def _copy_value(v):
+    if isinstance(v, dict):
+        return {k:_copy_value(x) for k, x in v.items()}
+    if isinstance(v, set):
+        return set(v)
+    return v
+
+def to_array_doc(doc, strings : StringTable = None, features : FeatureTable = None):
+    """ParsedDoc with the same sentences, converted to ArraySentence"""
+    from tree_path.parsed_doc import ParsedDoc
+    array_doc = ParsedDoc(doc.doc_id, dict(doc.meta_data))
+    array_doc.extend(ArraySentence(s, strings, features) for s in doc)
+    array_doc.make_id_dict()
+    return array_doc
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import itertools
+from typing import List, Dict, Iterator, Iterable, Set
+
+import numpy as np
+
+from tree_path.tree import Tree
+from tree_path.conllu import ParsedSentence
+from tree_path.evaluator import Evaluator, ValueComparer, ValueExpression, NodeEvaluator, ConstantEvaluator, Match
+from tree_path.search import Search
+from tree_path.array_sentence import StringTable, FeatureTable, STRINGS, FEATURES, \
+    _NO_VALUE, _EMPTY_SET, _STR_VALUE
+
+_STRING_KEYS = ('id', 'form', 'lemma', 'upos', 'xpos', 'deprel', 'head')
+
+def _none_value(ev : Evaluator) -> bool:
+    """Truth value of ev on a missing node, as for ../ at the root"""
+    if isinstance(ev, ConstantEvaluator):
+        return bool(ev._value)
+    if isinstance(ev, ValueExpression):
+        if ev.operator == '!':
+            return not _none_value(ev.left)
+        if ev.operator == '&':
+            return _none_value(ev.left) and _none_value(ev.right)
+        if ev.operator == '|':
+            return _none_value(ev.left) or _none_value(ev.right)
+        raise Exception('Unknown operator ' + ev.operator)
+    return False
+
+
+class CorpusColumns:
+    """The tokens of many sentences concatenated into NumPy columns: string codes, global parent rows,
+    preorder intervals, a feats bitmask and a (row, key, value) misc table.
+    Expressions are evaluated as boolean masks over all tokens at once, attribute comparisons as
+    array comparisons and axes as parent-array and preorder prefix-sum operations.
+    Comparisons the columns cannot represent (other keys, values that are not strings or sets)
+    are evaluated node by node"""
+    def __init__(self, sentences : Iterable[ParsedSentence], strings : StringTable = None,
+                 features : FeatureTable = None):
+        """sentences may be a DocList, a ParsedDoc or any iterable of sentences"""
+        self._strings = strings if strings is not None else STRINGS
+        self._features = features if features is not None else FEATURES
+        self.sentences : List[ParsedSentence] = []
+        self.nodes : List[Tree] = []
+        codes : Dict[str, List[int]] = {k:[] for k in _STRING_KEYS}
+        parent, rank, sentence, enter, preorder = [], [], [], [], []
+        feat_rows, feat_bits = [], []
+        misc_row, misc_key, misc_val = [], [], []
+        # keys whose values are not all strings, or feats that are not all dicts of non-empty sets
+        self._opaque : Set[str] = set()
+        for s in _iter_sentences(sentences):
+            offset = len(self.nodes)
+            node_list = s.node_list
+            rows = {id(n):offset + i for i, n in enumerate(node_list)}
+            rank.extend([0] * len(node_list))
+            for n in node_list:
+                for i, c in enumerate(n.children()):
+                    rank[rows[id(c)]] = i
+                data = n._data
+                for k in _STRING_KEYS:
+                    v = data.get(k)
+                    if v is not None and not isinstance(v, str):
+                        self._opaque.add(k)
+                        v = None
+                    codes[k].append(self._strings.code(v))
+                parent.append(rows[id(n.parent)] if n.parent is not None else -1)
+                sentence.append(len(self.sentences))
+                feats = data.get('feats') or {}
+                if not isinstance(feats, dict):
+                    self._opaque.add('feats')
+                    feats = {}
+                for k, values in feats.items():
+                    if not isinstance(values, (set, frozenset)) or not values:
+                        self._opaque.add('feats')
+                        continue
+                    for v in values:
+                        feat_rows.append(rows[id(n)])
+                        feat_bits.append(self._features.bit(k, v))
+                misc = data.get('misc') or {}
+                if not isinstance(misc, dict):
+                    self._opaque.add('misc')
+                    misc = {}
+                for k, values in misc.items():
+                    key = self._strings.code(k)
+                    if values is None:
+                        pairs = [_NO_VALUE]
+                    elif isinstance(values, str):
+                        pairs = [_STR_VALUE - self._strings.code(values)]
+                    elif not isinstance(values, (set, frozenset)):
+                        self._opaque.add('misc')
+                        continue
+                    else:
+                        pairs = [self._strings.code(v) for v in values] or [_EMPTY_SET]
+                    misc_row.extend([rows[id(n)]] * len(pairs))
+                    misc_key.extend([key] * len(pairs))
+                    misc_val.extend(pairs)
+            order = [rows[id(n)] for n in s.traverse()]
+            enter.extend([0] * len(node_list))
+            for i, r in enumerate(order):
+                enter[r] = offset + i
+            preorder.extend(order)
+            self.nodes.extend(node_list)
+            self.sentences.append(s)
+        n_rows = len(self.nodes)
+        self.codes : Dict[str, np.ndarray] = {k:np.array(v, dtype=np.int32) for k, v in codes.items()}
+        self.parent = np.array(parent, dtype=np.int32)
+        self.rank = np.array(rank, dtype=np.int32) # index among the parent's children
+        self.sentence = np.array(sentence, dtype=np.int32)
+        self.root_rows = np.flatnonzero(self.parent < 0).astype(np.int32)
+        self.enter = np.array(enter, dtype=np.int32)
+        self.preorder = np.array(preorder, dtype=np.int32)
+        # subtree sizes, accumulated from the leaves up in reverse preorder
+        size = np.ones(n_rows, dtype=np.int32)
+        for r in reversed(preorder):
+            if parent[r] >= 0:
+                size[parent[r]] += size[r]
+        self.exit = self.enter + size
+        self.feats = np.zeros((n_rows, self._features.words()), dtype=np.uint64)
+        if feat_rows:
+            bits = np.array(feat_bits, dtype=np.int64)
+            np.bitwise_or.at(self.feats, (np.array(feat_rows), bits // 64),
+                             np.left_shift(np.uint64(1), (bits % 64).astype(np.uint64)))
+        self.misc_row = np.array(misc_row, dtype=np.int32)
+        self.misc_key = np.array(misc_key, dtype=np.int32)
+        self.misc_val = np.array(misc_val, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.nodes)
+    def nbytes(self) -> int:
+        """Memory held by the column arrays"""
+        arrays = [self.parent, self.rank, self.sentence, self.root_rows, self.enter, self.exit, self.preorder, self.feats,
+                  self.misc_row, self.misc_key, self.misc_val] + list(self.codes.values())
+        return sum(a.nbytes for a in arrays)
+
+    def mask(self, expr : str|Search|Evaluator) -> np.ndarray:
+        """Boolean array over all tokens, true where the expression finds something starting from the token"""
+        return self._mask(_expr_tree(expr))
+
+    def _mask(self, ev : Evaluator) -> np.ndarray:
+        if isinstance(ev, ConstantEvaluator):
+            return np.full(len(self.nodes), bool(ev._value))
+        if isinstance(ev, ValueComparer):
+            return self._comparer_mask(ev)
+        if isinstance(ev, ValueExpression):
+            if ev.operator == '!':
+                return ~self._mask(ev.left)
+            if ev.operator == '&':
+                return self._mask(ev.left) & self._mask(ev.right)
+            if ev.operator == '|':
+                return self._mask(ev.left) | self._mask(ev.right)
+            raise Exception('Unknown operator ' + ev.operator)
+        if isinstance(ev, NodeEvaluator):
+            return self._axis_mask(ev.path_type, self._mask(ev.evaluator), _none_value(ev.evaluator))
+        raise Exception('Cannot vectorize evaluator ' + type(ev).__name__)
+
+    def _axis_mask(self, path_type : str, inner : np.ndarray, none_value : bool) -> np.ndarray:
+        """True for the tokens having a candidate on the path_type axis where inner is true"""
+        parent = self.parent
+        if path_type == '.':
+            return inner
+        if path_type == '../':
+            return np.where(parent >= 0, inner[parent], none_value)
+        if path_type in ('//', './/'):
+            counts = np.concatenate(([0], np.cumsum(inner[self.preorder], dtype=np.int32)))
+            start = self.enter + (1 if path_type == '//' else 0)
+            return counts[self.exit] > counts[start]
+        if path_type in ('/', './', '<', '>'):
+            child = inner & (parent >= 0)
+            if path_type == '<':
+                child &= np.arange(len(parent)) < parent
+            elif path_type == '>':
+                child &= np.arange(len(parent)) > parent
+            result = np.zeros(len(parent), dtype=bool)
+            result[parent[child]] = True
+            return result | inner if path_type == './' else result
+        raise Exception("Unkown path " + str(path_type))
+
+    def _comparer_mask(self, ev : ValueComparer) -> np.ndarray:
+        name = ev.name
+        if ev.operator not in ('=', '?=') or name[0] in self._opaque:
+            return self._node_mask(ev)
+        values = ev.value
+        any_value = '*' in values
+        if len(name) == 1 and name[0] in self.codes:
+            column = self.codes[name[0]]
+            present = column >= 0
+            hit = present if any_value else np.isin(column, self._value_codes(values))
+        elif len(name) == 2 and name[0] == 'feats':
+            present = self._feature_bits_mask(self._features.key_bits.get(name[1], []))
+            hit = present if any_value else \
+                self._feature_bits_mask([self._features.bits[(name[1], v)] for v in values
+                                         if (name[1], v) in self._features.bits])
+        elif len(name) == 2 and name[0] == 'misc':
+            key = self._strings.codes.get(name[1])
+            entries = self.misc_key == (key if key is not None else -1)
+            present = np.zeros(len(self.nodes), dtype=bool)
+            present[self.misc_row[entries & (self.misc_val != _NO_VALUE)]] = True
+            if any_value:
+                hit = present
+            else:
+                codes = self._value_codes(values)
+                found = np.isin(self.misc_val, codes) | np.isin(_STR_VALUE - self.misc_val, codes)
+                hit = np.zeros(len(self.nodes), dtype=bool)
+                hit[self.misc_row[entries & found]] = True
+        else:
+            return self._node_mask(ev)
+        return hit | ~present if ev.operator == '?=' else hit
+
+    def _value_codes(self, values : Set[str]) -> np.ndarray:
+        return np.array([self._strings.codes[v] for v in values if v in self._strings.codes], dtype=np.int32)
+
+    def _feature_bits_mask(self, bits : List[int]) -> np.ndarray:
+        """True for the tokens having any of the feature bits set"""
+        words = np.zeros(self.feats.shape[1], dtype=np.uint64)
+        for b in bits:
+            if b // 64 < len(words):
+                words[b // 64] |= np.uint64(1 << (b % 64))
+        return (self.feats & words).any(axis=1) if len(self.nodes) else np.zeros(0, dtype=bool)
+
+    def _node_mask(self, ev : Evaluator) -> np.ndarray:
+        return np.fromiter((bool(ev.evaluate(n)) for n in self.nodes), dtype=bool, count=len(self.nodes))
+
+    def _top_hits(self, ev : NodeEvaluator, inner : np.ndarray) -> np.ndarray:
+        """Rows of the candidates matching ev when it is evaluated at the sentence roots"""
+        parent = self.parent
+        is_root = parent < 0
+        child_of_root = np.zeros(len(parent), dtype=bool)
+        child_of_root[~is_root] = is_root[parent[~is_root]]
+        path_type = ev.path_type
+        if path_type == '.':
+            axis = is_root
+        elif path_type == '/':
+            axis = child_of_root
+        elif path_type == './':
+            axis = child_of_root | is_root
+        elif path_type == '//':
+            axis = ~is_root
+        elif path_type == './/':
+            axis = np.ones(len(parent), dtype=bool)
+        elif path_type in ('<', '>'):
+            rows = np.arange(len(parent))
+            axis = child_of_root & ((rows < parent) if path_type == '<' else (rows > parent))
+        elif path_type == '../':
+            axis = np.zeros(len(parent), dtype=bool)
+        else:
+            raise Exception("Unkown path " + str(path_type))
+        return np.flatnonzero(inner & axis)
+
+    def search(self, expr : str|Search, limit : int = None) -> Iterator[Match]:
+        """The matches Search.iter would give on every sentence, in sentence order.
+        Sentences are selected in a few vectorized passes, Match objects are built only for the hits"""
+        matches = self._search(_expr_tree(expr))
+        return matches if limit is None else itertools.islice(matches, limit)
+
+    def _search(self, ev : Evaluator) -> Iterator[Match]:
+        if not (isinstance(ev, NodeEvaluator) and ev.list_return):
+            for r in self.root_rows[self._mask(ev)[self.root_rows]].tolist():
+                yield Match(self.nodes[r])
+            return
+        if ev.path_type == '../':
+            if _none_value(ev.evaluator):
+                for s in self.sentences:
+                    yield from ev.iter(s)
+            return
+        hits = self._top_hits(ev, self._mask(ev.evaluator))
+        if ev.path_type in ('//', './/'):
+            hits = hits[np.argsort(self.enter[hits], kind='stable')]
+        elif ev.path_type != '.':
+            # the root first for ./, then children in the order the tree keeps them
+            hits = hits[np.lexsort((self.rank[hits], self.parent[hits] >= 0, self.sentence[hits]))]
+        with_matches = ev.evaluator.returns_list()
+        for r in hits.tolist():
+            node = self.nodes[r]
+            if with_matches:
+                result = ev.evaluator.evaluate(node)
+                yield Match(node, result if isinstance(result, list) else [])
+            else:
+                yield Match(node)
+
+    def count(self, expr : str|Search) -> int:
+        """Sum of Search.count over all sentences"""
+        ev = _expr_tree(expr)
+        if not (isinstance(ev, NodeEvaluator) and ev.list_return):
+            return int(np.count_nonzero(self._mask(ev)[self.root_rows]))
+        if ev.path_type == '../':
+            return len(self.sentences) if _none_value(ev.evaluator) else 0
+        return len(self._top_hits(ev, self._mask(ev.evaluator)))
+
+    def matching_sentences(self, expr : str|Search) -> List[ParsedSentence]:
+        """Sentences where the expression finds something"""
+        mask = self._mask(_expr_tree(expr))
+        return [self.sentences[i] for i in self.sentence[self.root_rows[mask[self.root_rows]]].tolist()]
+
+
+def _expr_tree(expr : str|Search|Evaluator) -> Evaluator:
+    if isinstance(expr, Evaluator):
+        return expr
+    if isinstance(expr, Search):
+        return expr._expr_tree
+    return Search.compile(expr)
+
+def _iter_sentences(sentences) -> Iterator[ParsedSentence]:
+    for s in sentences:
+        if isinstance(s, Tree):
+            yield s
+        else: # a document
+            yield from s
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import weakref
+from typing import List, Dict, Callable, Tuple, Iterator
+
+import tree_path.evaluator
+from tree_path.evaluator import Evaluator, ValueComparer, ValueExpression, NodeEvaluator, ConstantEvaluator, Match
+from tree_path.tree import Tree
+
+_INDENT = '    '
+
+class _Compiler:
+    def __init__(self):
+        self.constants : Dict[str, object] = {}
+        self.functions : List[List[str]] = []
+        self.function_names : Dict[Tuple[int, str], str] = {}
+        self._counter = 0
+    def new_name(self, prefix : str) -> str:
+        self._counter += 1
+        return '%s%d' % (prefix, self._counter)
+    def constant(self, value) -> str:
+        name = self.new_name('_k')
+        self.constants[name] = value
+        return name
+
+    def node_function(self, ev : NodeEvaluator, mode : str) -> str:
+        """Name of the function evaluating ev on a node.
+        mode is 'list' (list of Match), 'iter' (generator of Match), 'bool' (stops at the first match)
+        or 'count' (number of matches)"""
+        key = (id(ev), mode)
+        if key in self.function_names:
+            return self.function_names[key]
+        name = self.new_name('_n')
+        self.function_names[key] = name
+        lines = ['def %s(node):' % name,
+                 _INDENT + 'if not node: return %s' % {'count':'0', 'iter':''}.get(mode, 'False')]
+        if mode == 'list':
+            lines.append(_INDENT + 'result = []')
+        elif mode == 'count':
+            lines.append(_INDENT + 'result = 0')
+        body_indent = self.axis_loop(ev, 'node', 'c', lines, 1)
+        pred_list = mode in ('list', 'iter') and _may_list(ev.evaluator)
+        self.emit(ev.evaluator, 'c', 'r', pred_list, lines, body_indent)
+        prefix = _INDENT * body_indent
+        if mode == 'list':
+            if pred_list:
+                lines.append(prefix + 'if r: result.append(Match(c, r if r.__class__ is list else []))')
+            else:
+                lines.append(prefix + 'if r: result.append(Match(c))')
+            lines.append(_INDENT + 'return result')
+        elif mode == 'iter':
+            if pred_list:
+                lines.append(prefix + 'if r: yield Match(c, r if r.__class__ is list else [])')
+            else:
+                lines.append(prefix + 'if r: yield Match(c)')
+        elif mode == 'count':
+            lines.append(prefix + 'if r: result += 1')
+            lines.append(_INDENT + 'return result')
+        else:
+            lines.append(prefix + 'if r: return True')
+            lines.append(_INDENT + 'return False')
+        self.functions.append(lines)
+        return name
+
+    def axis_loop(self, ev : NodeEvaluator, node : str, cand : str, lines : List[str], indent : int) -> int:
+        """Writes the loop binding cand to each candidate node. Returns the indent of the loop body"""
+        prefix = _INDENT * indent
+        path_type = ev.path_type
+        if path_type == '../':
+            lines.append(prefix + 'for %s in (%s.parent,):' % (cand, node))
+        elif path_type == '/' and ev.index_constraint:
+            key, values = ev.index_constraint
+            lines.append(prefix + 'for %s in %s.children_with(%r, %s):' % (cand, node, key, self.constant(values)))
+        elif path_type == '/':
+            lines.append(prefix + 'for %s in %s._children:' % (cand, node))
+        elif path_type == './':
+            lines.append(prefix + 'for %s in (%s, *%s._children):' % (cand, node, node))
+        elif path_type == '.':
+            lines.append(prefix + 'for %s in (%s,):' % (cand, node))
+        elif path_type == '//':
+            lines.append(prefix + 'for %s in %s.descendants():' % (cand, node))
+        elif path_type == './/':
+            lines.append(prefix + 'for %s in %s.traverse():' % (cand, node))
+        elif path_type in ('<', '>'):
+            lines.append(prefix + 'for %s in %s._children:' % (cand, node))
+            lines.append(prefix + _INDENT + 'if %s_evaluator.before(%s, %s): continue'
+                         % ('not ' if path_type == '<' else '', cand, node))
+        else:
+            raise Exception("Unkown path " + str(path_type))
+        return indent + 1
+
+    def emit(self, ev : Evaluator, node : str, result : str, as_list : bool, lines : List[str], indent : int):
+        """Writes statements assigning the value of ev on node to result.
+        If as_list, result may be a non-empty list of Match, otherwise it is only tested for truth"""
+        prefix = _INDENT * indent
+        if isinstance(ev, ConstantEvaluator):
+            value = repr(ev._value) if isinstance(ev._value, bool) else self.constant(ev._value)
+            lines.append(prefix + '%s = %s' % (result, value))
+        elif isinstance(ev, ValueComparer):
+            self.emit_comparer(ev, node, result, lines, indent)
+        elif isinstance(ev, NodeEvaluator):
+            mode = 'list' if as_list and ev.list_return else 'bool'
+            lines.append(prefix + '%s = %s(%s)' % (result, self.node_function(ev, mode), node))
+        elif isinstance(ev, ValueExpression):
+            if ev.operator == '!':
+                self.emit(ev.left, node, result, False, lines, indent)
+                lines.append(prefix + '%s = not %s' % (result, result))
+            elif ev.operator not in ('&', '|'):
+                raise Exception('Unknown operator ' + ev.operator)
+            elif not (as_list and _may_list(ev)):
+                # only truth matters, short-circuit
+                self.emit(ev.left, node, result, False, lines, indent)
+                lines.append(prefix + ('if %s:' if ev.operator == '&' else 'if not %s:') % result)
+                self.emit(ev.right, node, result, False, lines, indent + 1)
+            else:
+                right = self.new_name('r')
+                self.emit(ev.left, node, result, True, lines, indent)
+                if ev.operator == '&':
+                    lines.append(prefix + 'if %s:' % result)
+                    self.emit(ev.right, node, right, True, lines, indent + 1)
+                    lines.append(prefix + _INDENT + '%s = _join(%s, %s) if %s else False' % (result, result, right, right))
+                else:
+                    self.emit(ev.right, node, right, True, lines, indent)
+                    lines.append(prefix + '%s = _join(%s, %s) if %s or %s else False'
+                                 % (result, result, right, result, right))
+        else:
+            raise Exception('Cannot compile evaluator ' + type(ev).__name__)
+
+    def emit_comparer(self, ev : ValueComparer, node : str, result : str, lines : List[str], indent : int):
+        if ev.operator not in ('=', '?='):
+            raise Exception('Unknown operator ' + ev.operator)
+        prefix = _INDENT * indent
+        values = self.constant(frozenset(ev.value))
+        lines.append(prefix + 'if %s is None: %s = False' % (node, result))
+        lines.append(prefix + 'else:')
+        prefix += _INDENT
+        lines.append(prefix + '%s = %s._data.get(%r)' % (result, node, ev.name[0]))
+        for key in ev.name[1:]:
+            lines.append(prefix + 'if %s is not None: %s = %s.get(%r)' % (result, result, result, key))
+        lines.append(prefix + 'if %s is None: %s = %s' % (result, result, ev.operator == '?='))
+        if '*' in ev.value:
+            lines.append(prefix + 'elif isinstance(%s, str): %s = True' % (result, result))
+            lines.append(prefix + 'elif isinstance(%s, (set, frozenset)): %s = True' % (result, result))
+        else:
+            lines.append(prefix + 'elif isinstance(%s, str): %s = %s in %s' % (result, result, result, values))
+            lines.append(prefix + 'elif isinstance(%s, (set, frozenset)): %s = not %s.isdisjoint(%s)' % (result, result, values, result))
+        lines.append(prefix + "else: raise Exception('Value of %s is not a string or set -- %%s' %% str(%s))"
+                     % ('.'.join(ev.name), result))
+
+    def top_function(self, expr_tree : Evaluator, mode : str) -> str:
+        if isinstance(expr_tree, NodeEvaluator) and (expr_tree.list_return or mode == 'bool'):
+            return self.node_function(expr_tree, mode)
+        name = self.new_name('_top')
+        lines = ['def %s(node):' % name]
+        self.emit(expr_tree, 'node', 'r', mode in ('list', 'iter'), lines, 1)
+        if mode == 'iter':
+            lines.append(_INDENT + 'if r.__class__ is list: yield from r')
+            lines.append(_INDENT + 'elif r: yield Match(node)')
+        else:
+            lines.append(_INDENT + ('return int(bool(r))' if mode == 'count' else 'return r'))
+        self.functions.append(lines)
+        return name
+
+    def source(self) -> str:
+        return '\n\n'.join('\n'.join(f) for f in self.functions) + '\n'
+
+
+def _may_list(ev : Evaluator) -> bool:
+    if isinstance(ev, NodeEvaluator):
+        return ev.list_return
+    if isinstance(ev, ValueExpression) and ev.operator in ('&', '|'):
+        return _may_list(ev.left) or _may_list(ev.right)
+    return False
+
+def _join(left, right) -> List[Match]|bool:
+    """Matches of two true operands, as ValueExpression.evaluate concatenates them"""
+    if left.__class__ is list:
+        return left + right if right.__class__ is list else left
+    return right if right.__class__ is list else True
+
+
+class CompiledSearch:
+    """An evaluator tree turned into specialized Python source, with attribute lookups and axis loops
+    written out inline and boolean logic short-circuited wherever the matches of an operand are not needed.
+    evaluate returns the same Match structures as Evaluator.evaluate"""
+    def __init__(self, expr_tree : Evaluator):
+        compiler = _Compiler()
+        entry, iter_entry, exists_entry, count_entry = [compiler.top_function(expr_tree, mode)
+                                                        for mode in ('list', 'iter', 'bool', 'count')]
+        self.source = compiler.source()
+        namespace = {'Match':Match, '_evaluator':tree_path.evaluator, '_join':_join}
+        namespace.update(compiler.constants)
+        exec(compile(self.source, '<tree_path %s>' % str(expr_tree), 'exec'), namespace)
+        self.evaluate : Callable[[Tree], List[Match]|bool] = namespace[entry]
+        self.iter : Callable[[Tree], Iterator[Match]] = namespace[iter_entry]
+        self.exists : Callable[[Tree], bool] = namespace[exists_entry]
+        self.count : Callable[[Tree], int] = namespace[count_entry]
+
+_compiled : weakref.WeakKeyDictionary[Evaluator, CompiledSearch] = weakref.WeakKeyDictionary()
+
+def compile_evaluator(expr_tree : Evaluator) -> CompiledSearch:
+    """Compiled form of expr_tree, built once per evaluator tree"""
+    compiled = _compiled.get(expr_tree)
+    if compiled is None:
+        compiled = CompiledSearch(expr_tree)
+        _compiled[expr_tree] = compiled
+    return compiled
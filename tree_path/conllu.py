@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import concurrent.futures
+import os
 from typing import List, Dict, Iterator, Tuple
 
 import pyconll
@@ -8,6 +10,9 @@ from pyconll.unit.token import Token
 
 from tree_path import Tree, Search, Match
 from tree_path.tree import Sequence, _sets2lists, _lists2sets
+from tree_path.interning import Interner, INTERNER
+from tree_path.conllu_reader import RawSentence, iter_raw_from_file, iter_raw_from_range, sentence_cuts
+from tree_path.signatures import iter_candidate_sentences
 
 
 def datum_to_conllu(datum) -> str:
@@ -26,10 +31,16 @@ def conllu_node(node : Tree) -> str:
     return '\t'.join(datum_to_conllu(node._data[a]) for a in attrib_list)
 
 
-def from_conllu(sentence: Sentence | str) -> Tree:
+def from_conllu(sentence: Sentence | RawSentence | str, interner : Interner|None = INTERNER) -> Tree:
+    """Token strings and feature values are shared through interner, unless it is None.
+    Strings and RawSentence are parsed by the native reader, pyconll sentences through conllu_dict"""
     if isinstance(sentence, str):
-        sentence = Sentence(sentence)
-    data_list = Sequence([conllu_dict(tok) for tok in sentence])
+        sentence = RawSentence({}, [line.strip() for line in sentence.split('\n')
+                                    if line.strip() and not line.strip().startswith('#')])
+    if isinstance(sentence, RawSentence):
+        data_list = Sequence(sentence.tokens(interner))
+    else:
+        data_list = Sequence([conllu_dict(tok, interner=interner) for tok in sentence])
     tree_dict = {d['id']: Tree(d, None, []) for d in data_list}
     root: Tree | None = None
     for id in [d['id'] for d in data_list]:  # just making sure to take ids in order
@@ -39,10 +50,10 @@ def from_conllu(sentence: Sentence | str) -> Tree:
             root = tree
         else:
             try:
-                tree.parent = tree_dict[tree._data['head']]
+                parent = tree_dict[tree._data['head']]
             except:
                 raise Exception('Unknown head id "%s"' % tree._data['head'])
-            tree.parent._children.append(tree)
+            parent.add_child(tree)
     if root is None:
         raise Exception('No root found.')
     parentless = [t for t in tree_dict.values() if t.parent is None and t is not root]
@@ -51,7 +62,8 @@ def from_conllu(sentence: Sentence | str) -> Tree:
     return root
 
 
-def conllu_dict(conllu_token: Token | str, attrib_list: List[str] = None) -> Dict[str, Dict | str]:
+def conllu_dict(conllu_token: Token | str, attrib_list: List[str] = None,
+                interner : Interner|None = None) -> Dict[str, Dict | str]:
     data: Dict[str, Dict | str] = dict()
     if isinstance(conllu_token, str):
         conllu_token = Token(conllu_token)
@@ -59,7 +71,7 @@ def conllu_dict(conllu_token: Token | str, attrib_list: List[str] = None) -> Dic
         attrib_list = ['deprel', 'deps', 'feats', 'form', 'head', 'id', 'lemma', 'misc', 'upos', 'xpos']
     for attrib in attrib_list:
         data[attrib] = conllu_token.__getattribute__(attrib)
-    return data
+    return interner.token(data) if interner is not None else data
 
 
 class ParsedSentence(Tree):
@@ -70,8 +82,11 @@ class ParsedSentence(Tree):
         self.sent_id = sent_id
         self.sent_text = sent_text
         self.meta_data = meta_data if meta_data else {}
+        self.make_preorder_index()
         self.node_list = [n for n in self.traverse()]
         self.node_list.sort(key=lambda n : int(n._data['id']))
+        for i, n in enumerate(self.node_list):
+            n._position = i
         self.node_dict = {n._data['id']:n for n in self.node_list}
     def __str__(self):
         return self.sent_text
@@ -83,17 +98,17 @@ class ParsedSentence(Tree):
         json_dict['node'] = Tree.to_jsonable(self)
         return json_dict
     @staticmethod
-    def from_jsonable(json_dict : Dict) -> ParsedSentence:
+    def from_jsonable(json_dict : Dict, interner : Interner|None = INTERNER) -> ParsedSentence:
         sent_id = json_dict['sent_id']
         sent_text = json_dict['sent_text']
         meta_data = _lists2sets(json_dict['meta_data'])
-        node = Tree.from_jsonable(json_dict['node'])
+        node = Tree.from_jsonable(json_dict['node'], interner)
         return ParsedSentence(node, sent_id, sent_text, meta_data)
     @staticmethod
     def iter_from_file(filename : str) -> Iterator[ParsedSentence]:
-        for s_conllu in pyconll.iter_from_file(filename):
+        for s_conllu in iter_raw_from_file(filename):
             tree = from_conllu(s_conllu)
-            psentence = ParsedSentence(tree, s_conllu.id, s_conllu.text, dict(s_conllu._meta))
+            psentence = ParsedSentence(tree, s_conllu.id, s_conllu.text, dict(s_conllu.meta))
             yield psentence
     
     def conllu(self) -> str:
@@ -114,13 +129,10 @@ class ParsedSentence(Tree):
         return tok_unique_id(self.sent_id, node)
     @staticmethod
     def get_syntactic_distance(n1 : Tree, n2 : Tree) -> int|None:
-        ancestors1 = n1.ancestors() # note, ancestors include self
-        ancestors2 = n2.ancestors()
-        common = [a for a in ancestors1 if a in ancestors2]
-        if not common:
+        common = n1.common_ancestor(n2)
+        if common is None:
             return None
-        common = common[0]
-        return ancestors1.index(common) + ancestors2.index(common)
+        return n1.depth() + n2.depth() - 2 * common.depth()
 
 
 def tok_unique_id(sent_id : str, tok_id : str) -> str:
@@ -133,12 +145,15 @@ def sent_tok_id_from_unique(unique_id : str) -> Tuple:
     return tuple(unique_id.rsplit('-', 1))
 
 
-def search_conllu_files(search : str|Search , filenames : List[str]) -> List[Match]:
+def search_conllu_files(search : str|Search , filenames : List[str], signatures : bool = False) -> List[Match]:
+    """With signatures, only the sentences whose signature allows a match are parsed, see signatures.py.
+    The signatures and the sentence index are computed and saved next to each file if needed"""
     matches : List[Match] = []
     if not isinstance(search, Search):
         search = Search(search)
     for filename in filenames:
-        for sentence in pyconll.iter_from_file(filename):
+        sentences = iter_candidate_sentences(filename, search) if signatures else iter_raw_from_file(filename)
+        for sentence in sentences:
             try:
                 tree = from_conllu(sentence)
             except Exception as e:
@@ -151,6 +166,79 @@ def search_conllu_files(search : str|Search , filenames : List[str]) -> List[Mat
     return matches
 
 
+class MatchRecord:
+    """Picklable summary of a Match: where it was found and the token ids of the matched nodes.
+    next_ids holds (id, next_ids) pairs for the next nodes of the match. The id is None where the match has no node,
+    as for ../[*] on the root"""
+    __slots__ = ('filename', 'sent_id', 'node_id', 'next_ids')
+    def __init__(self, filename : str, sent_id : str, node_id : str, next_ids : Tuple = ()):
+        self.filename = filename
+        self.sent_id = sent_id
+        self.node_id = node_id
+        self.next_ids = next_ids
+    @staticmethod
+    def from_match(match : Match, filename : str, sent_id : str) -> MatchRecord:
+        return MatchRecord(filename, sent_id, _node_id(match.node), _next_ids(match.next_nodes))
+    def uid(self) -> str|None:
+        return tok_unique_id(self.sent_id, self.node_id) if self.node_id is not None else None
+    def to_match(self, sentence : ParsedSentence) -> Match:
+        """The Match, rebuilt on the parsed sentence"""
+        return _rebuild_match(sentence, self.node_id, self.next_ids)
+    def __eq__(self, other):
+        return isinstance(other, MatchRecord) and (self.filename, self.sent_id, self.node_id, self.next_ids) == \
+            (other.filename, other.sent_id, other.node_id, other.next_ids)
+    def __hash__(self):
+        return hash((self.filename, self.sent_id, self.node_id, self.next_ids))
+    def __str__(self):
+        return '%s:%s' % (self.filename, self.uid())
+    def __repr__(self):
+        return self.__str__()
+
+def _node_id(node : Tree|None) -> str|None:
+    return node._data['id'] if node is not None else None
+
+def _next_ids(matches : List[Match]) -> Tuple:
+    return tuple((_node_id(m.node), _next_ids(m.next_nodes)) for m in matches)
+
+def _rebuild_match(sentence : ParsedSentence, node_id : str|None, next_ids : Tuple) -> Match:
+    node = sentence.node_dict[node_id] if node_id is not None else None
+    return Match(node, [_rebuild_match(sentence, i, n) for i, n in next_ids])
+
+def search_conllu_files_parallel(search : str|Search, filenames : List[str], jobs : int = None,
+                                 piece_bytes : int = 1 << 22) -> Iterator[MatchRecord]:
+    """Same matches as search_conllu_files, as MatchRecords. Files are cut at sentence boundaries into pieces
+    of about piece_bytes, searched by a pool of jobs processes (by default one per cpu).
+    Records come back in file and sentence order as the pieces complete"""
+    if not isinstance(search, Search):
+        search = Search(search) # parse errors are raised here rather than in the workers
+    pieces = []
+    for filename in filenames:
+        cuts = sentence_cuts(filename, piece_bytes)
+        pieces += [(search._expression, search.backend, search.planner, filename, start, end)
+                   for start, end in zip(cuts, cuts[1:])]
+    jobs = jobs if jobs else os.cpu_count() or 1
+    if jobs == 1 or len(pieces) <= 1:
+        for piece in pieces:
+            yield from _search_piece(piece)
+        return
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        for records in executor.map(_search_piece, pieces):
+            yield from records
+
+def _search_piece(piece : Tuple) -> List[MatchRecord]:
+    expression, backend, planner, filename, start, end = piece
+    search = Search(expression, backend, planner)
+    records = []
+    for sentence in iter_raw_from_range(filename, start, end):
+        try:
+            tree = from_conllu(sentence)
+        except Exception as e:
+            print(str(e) + ' in ' + (str(sentence.id) if sentence and sentence.id else ''))
+            continue
+        records += [MatchRecord.from_match(m, filename, sentence.id) for m in search.iter(tree)]
+    return records
+
+
 def get_full_lemma(n : Tree):
     s = Search('/[deprel=fixed]')
     lemma = n._data['lemma']
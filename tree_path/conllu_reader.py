@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import bisect
+import contextlib
+import gc
+import json
+import os
+import re
+import sys
+from typing import List, Dict, Iterator, Iterable, Tuple
+
+from tree_path.interning import Interner
+
+# Streaming CoNLL-U reader producing the same token dicts as conllu.conllu_dict on pyconll tokens,
+# without building pyconll objects first
+
+_KEY_VALUE_COMMENT = re.compile(r'#\s*([^=]+?)\s*=\s*(.+)')
+_SINGLETON_COMMENT = re.compile(r'#\s*(\S.*?)\s*$')
+
+
+class RawSentence:
+    """Comment lines of a sentence parsed into meta, token lines kept as they are"""
+    __slots__ = ('meta', 'lines')
+    def __init__(self, meta : Dict[str, str|None], lines : List[str]):
+        self.meta = meta
+        self.lines = lines
+    @property
+    def id(self) -> str|None:
+        return self.meta.get('sent_id')
+    @property
+    def text(self) -> str|None:
+        return self.meta.get('text')
+    def meta_present(self, key : str) -> bool:
+        return key in self.meta
+    def meta_value(self, key : str) -> str|None:
+        return self.meta[key]
+    def tokens(self, interner : Interner|None = None) -> List[Dict]:
+        return [parse_token(line, interner) for line in self.lines]
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """Suspends the cyclic garbage collector, which otherwise rescans the growing corpus many times while
+    it is being loaded, to find nothing: the loaded objects all stay alive"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def iter_raw_sentences(lines : Iterable[str]) -> Iterator[RawSentence]:
+    """Sentences of a CoNLL-U line source, split at blank lines as pyconll.iter_sentences does"""
+    meta : Dict[str, str|None] = {}
+    token_lines : List[str] = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if meta or token_lines:
+                yield RawSentence(meta, token_lines)
+                meta, token_lines = {}, []
+        elif line[0] == '#':
+            match = _KEY_VALUE_COMMENT.match(line)
+            if match:
+                meta[match.group(1)] = match.group(2)
+            else:
+                match = _SINGLETON_COMMENT.match(line)
+                if match:
+                    meta[match.group(1)] = None
+        else:
+            token_lines.append(line)
+    if meta or token_lines:
+        yield RawSentence(meta, token_lines)
+
+def iter_raw_from_file(filename : str) -> Iterator[RawSentence]:
+    with open(filename, encoding='utf-8') as handle:
+        yield from iter_raw_sentences(handle)
+
+
+def iter_raw_from_range(filename : str, start : int, end : int) -> Iterator[RawSentence]:
+    """Sentences in bytes [start, end) of the file, which should be sentence boundaries"""
+    with open(filename, 'rb') as handle:
+        handle.seek(start)
+        data = handle.read(end - start)
+    yield from iter_raw_sentences(data.decode('utf-8').split('\n'))
+
+def sentence_cuts(filename : str, piece_bytes : int) -> List[int]:
+    """Offsets splitting the file into pieces of about piece_bytes, each cut just after a blank line,
+    starting with 0 and ending with the file size"""
+    size = os.path.getsize(filename)
+    cuts = [0]
+    with open(filename, 'rb') as handle:
+        while cuts[-1] + piece_bytes < size:
+            handle.seek(cuts[-1] + piece_bytes)
+            handle.readline() # rest of the line the target falls in
+            line = handle.readline()
+            while line and line.strip():
+                line = handle.readline()
+            if not line:
+                break
+            cuts.append(handle.tell())
+    if cuts[-1] != size:
+        cuts.append(size)
+    return cuts
+
+def document_offsets(filename : str, doc_id_key : str) -> List[int]:
+    """Byte offsets of the sentences starting a document, i.e. having a doc_id_key comment"""
+    with open(filename, 'rb') as handle:
+        data = handle.read()
+    # ends of the blank line runs separating sentences, as line.strip() sees them
+    blank_ends = [m.end() for m in re.finditer(rb'\n(?:[^\S\n]*\n)+', data)]
+    key = re.escape(doc_id_key.strip().encode('utf-8'))
+    offsets = []
+    for m in re.finditer(rb'^[^\S\n]*#[^\S\n]*' + key + rb'[^\S\n]*(?:=|$)', data, re.MULTILINE):
+        i = bisect.bisect_right(blank_ends, m.start())
+        start = blank_ends[i - 1] if i else 0
+        if not offsets or offsets[-1] != start:
+            offsets.append(start)
+    return offsets
+
+class SentenceIndex:
+    """Byte ranges of the sentences of a CoNLL-U file, found by sent_id or by document. The index is saved next to
+    the file (filename + SUFFIX) and rebuilt when the size or modification time of the file change"""
+    SUFFIX = '.tpidx'
+    VERSION = 1
+    def __init__(self, filename : str, doc_id_key : str, starts : List[int], ends : List[int],
+                 sent_ids : List[str|None], docs : List[Tuple[str, int]]):
+        self.filename = filename
+        self.doc_id_key = doc_id_key
+        self.starts = starts
+        self.ends = ends
+        self.sent_ids = sent_ids
+        self.docs = docs # (doc id, position of its first sentence), in file order
+        self.positions : Dict[str, List[int]] = {}
+        for i, sent_id in enumerate(sent_ids):
+            if sent_id is not None:
+                self.positions.setdefault(sent_id, []).append(i)
+        self.doc_positions : Dict[str, int] = {}
+        for doc_id, i in docs:
+            self.doc_positions.setdefault(doc_id, i)
+
+    @staticmethod
+    def for_file(filename : str, doc_id_key : str = 'newdoc id', save : bool = True) -> SentenceIndex:
+        """The saved index if it is up to date, else a new one, saved if save"""
+        stat = os.stat(filename)
+        try:
+            with open(filename + SentenceIndex.SUFFIX, encoding='utf-8') as handle:
+                saved = json.load(handle)
+            if (saved['version'], saved['size'], saved['mtime_ns'], saved['doc_id_key']) == \
+                    (SentenceIndex.VERSION, stat.st_size, stat.st_mtime_ns, doc_id_key):
+                return SentenceIndex(filename, doc_id_key, saved['starts'], saved['ends'], saved['sent_ids'],
+                                     [tuple(d) for d in saved['docs']])
+        except (OSError, ValueError, KeyError):
+            pass
+        index = SentenceIndex.build(filename, doc_id_key)
+        if save:
+            index.save(stat)
+        return index
+
+    @staticmethod
+    def build(filename : str, doc_id_key : str = 'newdoc id') -> SentenceIndex:
+        """Scans the file, splitting sentences at blank lines as iter_raw_sentences does"""
+        starts, ends, sent_ids, docs = [], [], [], []
+        start, sent_id = None, None
+        offset = 0
+        with open(filename, 'rb') as handle:
+            for line in handle:
+                if not line.strip():
+                    if start is not None:
+                        starts.append(start)
+                        ends.append(offset)
+                        sent_ids.append(sent_id)
+                        start, sent_id = None, None
+                else:
+                    if start is None:
+                        start = offset
+                    if line.lstrip()[:1] == b'#':
+                        match = _KEY_VALUE_COMMENT.match(line.decode('utf-8').strip())
+                        if match:
+                            if match.group(1) == 'sent_id':
+                                sent_id = match.group(2)
+                            elif match.group(1) == doc_id_key:
+                                docs.append((match.group(2), len(starts)))
+                offset += len(line)
+        if start is not None:
+            starts.append(start)
+            ends.append(offset)
+            sent_ids.append(sent_id)
+        return SentenceIndex(filename, doc_id_key, starts, ends, sent_ids, docs)
+
+    def save(self, stat : os.stat_result = None):
+        """Writes the index next to the file. Does nothing if that is not possible"""
+        stat = stat if stat is not None else os.stat(self.filename)
+        saved = {'version':SentenceIndex.VERSION, 'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns,
+                 'doc_id_key':self.doc_id_key, 'starts':self.starts, 'ends':self.ends, 'sent_ids':self.sent_ids,
+                 'docs':self.docs}
+        try:
+            with open(self.filename + SentenceIndex.SUFFIX, 'w', encoding='utf-8') as handle:
+                json.dump(saved, handle)
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self.starts)
+    def position(self, sent_id : str) -> int|None:
+        """Position of the first sentence with sent_id"""
+        positions = self.positions.get(sent_id)
+        return positions[0] if positions else None
+    def doc_range(self, doc_id : str) -> range|None:
+        """Positions of the sentences from the start of doc_id to the start of the next document"""
+        i = self.doc_positions.get(doc_id)
+        if i is None:
+            return None
+        k = bisect.bisect_right([p for _, p in self.docs], i)
+        return range(i, self.docs[k][1] if k < len(self.docs) else len(self))
+    def text(self, i : int) -> str:
+        """CoNLL-U text of the sentence at position i, as in the file"""
+        return self.texts([i])[0]
+    def texts(self, positions : Iterable[int]) -> List[str]:
+        """Texts of the sentences at positions, read in file order and returned in the order given"""
+        positions = list(positions)
+        texts = {}
+        with open(self.filename, 'rb') as handle:
+            for i in sorted(set(positions)):
+                handle.seek(self.starts[i])
+                texts[i] = handle.read(self.ends[i] - self.starts[i]).decode('utf-8')
+        return [texts[i] for i in positions]
+    def raw_sentence(self, i : int) -> RawSentence:
+        return next(iter_raw_sentences(self.text(i).split('\n')))
+    def sentence_text(self, sent_id : str) -> str|None:
+        i = self.position(sent_id)
+        return self.text(i) if i is not None else None
+    def select(self, sent_ids : Iterable[str], first_only : bool = False) -> List[int]:
+        """Positions of the sentences having the given ids, in file order"""
+        found = []
+        for sent_id in set(sent_ids):
+            positions = self.positions.get(sent_id, [])
+            found.extend(positions[:1] if first_only else positions)
+        return sorted(found)
+
+
+def parse_token(line : str, interner : Interner|None = None) -> Dict:
+    """Token dict of a CoNLL-U token line, with the keys, values and empty ('_') handling of conllu_dict"""
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) != 10:
+        raise Exception('The number of columns per token line must be 10. Invalid token: %s' % line)
+    tok_id, form, lemma, upos, xpos, feats, head, deprel, deps, misc = fields
+    if form != '_' or lemma != '_': # both '_' means an actual underscore
+        form = None if form == '_' else form
+        lemma = None if lemma == '_' else lemma
+    if interner is None:
+        data = {'deprel':None if deprel == '_' else deprel,
+                'deps':_parse_deps(deps),
+                'feats':_parse_feats(feats, None),
+                'form':form,
+                'head':None if head == '_' else head,
+                'id':tok_id,
+                'lemma':lemma,
+                'misc':_parse_misc(misc, None),
+                'upos':None if upos == '_' else upos,
+                'xpos':None if xpos == '_' else xpos}
+        return data
+    deprel, form, head, tok_id, lemma, upos, xpos = interner.strings(
+        [None if deprel == '_' else deprel, form, None if head == '_' else head, tok_id, lemma,
+         None if upos == '_' else upos, None if xpos == '_' else xpos])
+    return {'deprel':deprel,
+            'deps':_parse_deps(deps),
+            'feats':_interned_feats(feats, interner),
+            'form':form,
+            'head':head,
+            'id':tok_id,
+            'lemma':lemma,
+            'misc':_parse_misc(misc, interner),
+            'upos':upos,
+            'xpos':xpos}
+
+def _split_attributes(column : str) -> Iterator[Tuple[str, str|None]]:
+    for item in column.split('|'):
+        key, sep, value = item.partition('=')
+        yield key, value if value else None
+
+def _parse_feats(column : str, interner : Interner|None) -> Dict:
+    if column == '_':
+        return {}
+    feats = {}
+    for key, value in _split_attributes(column):
+        if value is None:
+            raise Exception('Error parsing "%s" properly. Please check against CoNLL format spec.' % column)
+        if interner is None:
+            feats[key] = set(value.split(','))
+        else:
+            feats[interner.string(key)] = interner.frozen(value.split(','))
+    return feats
+
+def _interned_feats(column : str, interner : Interner) -> Dict:
+    """Feats of a column, parsed once per distinct column string"""
+    parsed = interner.feats_columns.get(column)
+    if parsed is None:
+        feats = _parse_feats(column, interner)
+        parsed = (tuple(feats.items()), sum(map(sys.getsizeof, feats.values())))
+        interner.add_feats_column(column, parsed)
+    else:
+        interner.shared += len(parsed[0])
+        interner.saved_bytes += parsed[1]
+    return dict(parsed[0])
+
+def _parse_misc(column : str, interner : Interner|None) -> Dict:
+    if column == '_':
+        return {}
+    misc = {}
+    for key, value in _split_attributes(column):
+        if interner is None:
+            misc[key] = None if value is None else set(value.split(','))
+        else:
+            misc[interner.string(key)] = None if value is None else {interner.string(v) for v in value.split(',')}
+    return misc
+
+def _parse_deps(column : str) -> Dict:
+    if column == '_':
+        return {}
+    deps = {}
+    for item in column.split('|'):
+        key, sep, value = item.partition(':')
+        if not value:
+            raise Exception('Error parsing "%s" as tuple properly. Please check against CoNLL format spec.' % value)
+        components = value.split(':')
+        if len(components) > 4:
+            raise Exception('Error parsing "%s" as tuple properly. Please check against CoNLL format spec.' % value)
+        deps[key] = tuple(components + [None] * (4 - len(components)))
+    return deps
@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import gzip
+import json
+import mmap
+import struct
+from typing import List, Dict, Iterator, Iterable, Tuple
+
+import numpy as np
+
+from tree_path.tree import Tree, _sets2lists, _lists2sets
+from tree_path.conllu import ParsedSentence
+from tree_path.parsed_doc import ParsedDoc, DocList
+from tree_path.interning import Interner, INTERNER
+from tree_path.conllu_reader import gc_paused
+
+# Binary corpus file, the columnar counterpart of the .jz files:
+#   header: MAGIC, version (uint32), reserved (uint32), directory offset and length (uint64)
+#   blocks, 8-byte aligned: strings and typed NumPy columns
+#   directory: json with the block table (name -> offset, length, dtype, shape), doc ids and meta data
+# Tokens of all sentences are stored in sentence order, one row each. A token whose data does not fit
+# the columns (other keys, deps, values that are not strings or sets) is stored whole in the json extras
+
+MAGIC = b'TPCORPUS'
+VERSION = 1
+_HEADER = struct.Struct('<8sIIQQ')
+_ALIGN = 8
+
+_KEYS = ('deprel', 'deps', 'feats', 'form', 'head', 'id', 'lemma', 'misc', 'upos', 'xpos')
+_STRING_KEYS = ('id', 'form', 'lemma', 'upos', 'xpos', 'deprel', 'head')
+# token columns
+ID, FORM, LEMMA, UPOS, XPOS, DEPREL, HEAD = range(7) # string codes, -1 for None
+PARENT = 7 # row of the parent within the sentence, -1 for the root
+RANK = 8 # index among the parent's children
+_N_COLS = 9
+# misc value codes: >= 0 member of a value set, -1 for Key (no value), -2 for an empty set,
+# <= -3 for a plain string value coded -3 - code
+_NO_VALUE, _EMPTY_SET, _STR_VALUE = -1, -2, -3
+
+
+class _StringCodes:
+    def __init__(self):
+        self.codes : Dict[str, int] = {}
+    def __call__(self, s : str|None) -> int:
+        if s is None:
+            return -1
+        c = self.codes.get(s)
+        if c is None:
+            if '\0' in s:
+                raise ValueError('Cannot store string containing NUL: %r' % s)
+            c = self.codes[s] = len(self.codes)
+        return c
+
+def _is_standard(data : Dict) -> bool:
+    if tuple(data) != _KEYS or data['deps']:
+        return False
+    if any(data[k] is not None and not isinstance(data[k], str) for k in _STRING_KEYS):
+        return False
+    feats, misc = data['feats'], data['misc']
+    if not isinstance(feats, dict) or not isinstance(misc, dict):
+        return False
+    if not all(isinstance(v, (set, frozenset)) and v and all(isinstance(x, str) for x in v) for v in feats.values()):
+        return False
+    return all(v is None or isinstance(v, str) or
+               (isinstance(v, (set, frozenset)) and all(isinstance(x, str) for x in v)) for v in misc.values())
+
+
+def write_corpus(filename : str, docs : ParsedDoc|Iterable[ParsedDoc]):
+    """Writes a ParsedDoc, or a DocList or any sequence of documents, as a corpus file"""
+    single = isinstance(docs, ParsedDoc)
+    if single:
+        docs = [docs]
+    code = _StringCodes()
+    pair_codes : Dict[Tuple[int, int], int] = {}
+    doc_info = []
+    doc_sentences, sent_tokens = [0], [0]
+    sent_ids, sent_texts, sent_meta = [], [], {}
+    cols, feats_start, feats, misc_start, misc = [], [0], [], [0], []
+    extras : Dict[int, Dict] = {}
+    for doc in docs:
+        doc_info.append({'doc_id':doc.doc_id, 'meta_data':doc.meta_data})
+        for s in doc:
+            if s.meta_data:
+                sent_meta[len(sent_ids)] = _sets2lists(s.meta_data)
+            sent_ids.append(code(s.sent_id))
+            sent_texts.append(code(s.sent_text))
+            rows = {id(n):i for i, n in enumerate(s.node_list)}
+            for n in s.node_list:
+                data = n._data
+                parent = rows[id(n.parent)] if n.parent is not None else -1
+                rank = n.parent._children.index(n) if n.parent is not None else 0
+                if _is_standard(data):
+                    cols.append([code(data[k]) for k in _STRING_KEYS] + [parent, rank])
+                    for k, values in data['feats'].items():
+                        key = code(k)
+                        for v in values:
+                            pair = (key, code(v))
+                            feats.append(pair_codes.setdefault(pair, len(pair_codes)))
+                    for k, values in data['misc'].items():
+                        key = code(k)
+                        if values is None:
+                            misc.append((key, _NO_VALUE))
+                        elif isinstance(values, str):
+                            misc.append((key, _STR_VALUE - code(values)))
+                        elif not values:
+                            misc.append((key, _EMPTY_SET))
+                        else:
+                            misc.extend((key, code(v)) for v in values)
+                else:
+                    cols.append([-1] * len(_STRING_KEYS) + [parent, rank])
+                    extras[len(cols) - 1] = _sets2lists(data)
+                feats_start.append(len(feats))
+                misc_start.append(len(misc))
+            sent_tokens.append(len(cols))
+        doc_sentences.append(len(sent_ids))
+    pairs = sorted(pair_codes, key=pair_codes.get)
+    blocks = {
+        'strings':'\0'.join(code.codes).encode('utf-8'),
+        'doc_sentences':np.array(doc_sentences, dtype=np.int64),
+        'sent_tokens':np.array(sent_tokens, dtype=np.int64),
+        'sent_ids':np.array(sent_ids, dtype=np.int32),
+        'sent_texts':np.array(sent_texts, dtype=np.int32),
+        'tokens':np.array(cols, dtype=np.int32).reshape(-1, _N_COLS),
+        'feats_start':np.array(feats_start, dtype=np.int64),
+        'feats':np.array(feats, dtype=np.int32),
+        'feat_pairs':np.array(pairs, dtype=np.int32).reshape(-1, 2),
+        'misc_start':np.array(misc_start, dtype=np.int64),
+        'misc':np.array(misc, dtype=np.int32).reshape(-1, 2),
+        'sent_meta':json.dumps(sent_meta).encode('utf-8'),
+        'extras':json.dumps(extras).encode('utf-8'),
+    }
+    directory = {'single_doc':single, 'docs':doc_info, 'n_strings':len(code.codes), 'blocks':{}}
+    with open(filename, 'wb') as handle:
+        handle.write(_HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        for name, block in blocks.items():
+            handle.write(b'\0' * (-handle.tell() % _ALIGN))
+            if isinstance(block, np.ndarray):
+                directory['blocks'][name] = [handle.tell(), block.nbytes, block.dtype.str, list(block.shape)]
+                handle.write(block.tobytes())
+            else:
+                directory['blocks'][name] = [handle.tell(), len(block), None, None]
+                handle.write(block)
+        encoded = json.dumps(directory).encode('utf-8')
+        offset = handle.tell()
+        handle.write(encoded)
+        handle.seek(0)
+        handle.write(_HEADER.pack(MAGIC, VERSION, 0, offset, len(encoded)))
+
+
+class CorpusFile:
+    """Reader of a corpus file. The file is memory-mapped and documents or sentences are built on request,
+    so opening it only reads the directory, the string table and the json side blocks"""
+    def __init__(self, filename : str, interner : Interner|None = INTERNER):
+        """Token strings and feature values are shared through interner, unless it is None"""
+        self.filename = filename
+        self.interner = interner
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, offset, length = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise Exception('%s is not a tree_path corpus file' % filename)
+        if version != VERSION:
+            raise Exception('Unsupported corpus file version %d' % version)
+        directory = json.loads(self._map[offset:offset+length].decode('utf-8'))
+        self._blocks = directory['blocks']
+        self.single_doc : bool = directory['single_doc']
+        self._docs : List[Dict] = directory['docs']
+        self.doc_ids : List[str] = [d['doc_id'] for d in self._docs]
+        strings = self._bytes('strings').decode('utf-8')
+        self.strings : List[str] = strings.split('\0') if directory['n_strings'] else []
+        if interner is not None:
+            self.strings = interner.strings(self.strings)
+        self.doc_sentences = self._array('doc_sentences')
+        self.sent_tokens = self._array('sent_tokens')
+        self.sent_ids = self._array('sent_ids')
+        self.sent_texts = self._array('sent_texts')
+        self.tokens = self._array('tokens')
+        self.feats_start = self._array('feats_start')
+        self.feats = self._array('feats')
+        self.misc_start = self._array('misc_start')
+        self.misc = self._array('misc')
+        self._sent_meta = {int(k):v for k, v in json.loads(self._bytes('sent_meta')).items()}
+        self._extras = {int(k):v for k, v in json.loads(self._bytes('extras')).items()}
+        strings = self.strings
+        # string codes to values, -1 (last item) to None
+        self._lookup = strings + [None]
+        # feature value sets, by the (key, value) pair codes of a token
+        self._pairs = [(strings[k], strings[v]) for k, v in self._array('feat_pairs').tolist()]
+        self._feats_cache : Dict[Tuple[int, ...], Tuple[Tuple[str, frozenset], ...]] = {}
+
+    def _bytes(self, name : str) -> bytes:
+        offset, length, _, _ = self._blocks[name]
+        return self._map[offset:offset+length]
+    def _array(self, name : str) -> np.ndarray:
+        offset, length, dtype, shape = self._blocks[name]
+        return np.frombuffer(self._map, dtype=np.dtype(dtype), count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+    def __len__(self):
+        return len(self._docs)
+    def sentence_count(self) -> int:
+        return len(self.sent_ids)
+    def doc_sentence_range(self, i : int) -> range:
+        """Global indexes of the sentences of document i"""
+        return range(int(self.doc_sentences[i]), int(self.doc_sentences[i+1]))
+    def sentence_id(self, j : int) -> str:
+        return self.strings[self.sent_ids[j]]
+
+    def read_doc(self, i : int, make_dict_id : bool = True) -> ParsedDoc:
+        info = self._docs[i]
+        doc = ParsedDoc(info['doc_id'], info['meta_data'])
+        with gc_paused():
+            doc.extend(self.read_sentence(j) for j in self.doc_sentence_range(i))
+            if make_dict_id:
+                doc.make_id_dict()
+        return doc
+    def iter_docs(self, make_dict_id : bool = True) -> Iterator[ParsedDoc]:
+        for i in range(len(self)):
+            yield self.read_doc(i, make_dict_id)
+    def read_all(self, make_dict_id : bool = True) -> ParsedDoc|DocList:
+        """The stored ParsedDoc, or DocList if more than one document (or a DocList) was written"""
+        if self.single_doc:
+            return self.read_doc(0, make_dict_id)
+        with gc_paused():
+            return DocList(list(self.iter_docs(make_dict_id)))
+
+    def read_sentence(self, j : int) -> ParsedSentence:
+        """Sentence j, counting the sentences of all documents"""
+        start, end = int(self.sent_tokens[j]), int(self.sent_tokens[j+1])
+        strings = self._lookup
+        cols = self.tokens[start:end].tolist()
+        feats_start = self.feats_start[start:end+1].tolist()
+        feats = self.feats[feats_start[0]:feats_start[-1]].tolist()
+        misc_start = self.misc_start[start:end+1].tolist()
+        misc = self.misc[misc_start[0]:misc_start[-1]].tolist()
+        f0, m0 = feats_start[0], misc_start[0]
+        extras = self._extras
+        nodes = []
+        for i, (tok_id, form, lemma, upos, xpos, deprel, head, _, _) in enumerate(cols):
+            extra = extras.get(start + i) if extras else None
+            if extra is not None:
+                data = self.interner.token(extra) if self.interner is not None else _lists2sets(extra)
+            else:
+                token_misc = {}
+                if misc_start[i] != misc_start[i+1]:
+                    for k, v in misc[misc_start[i]-m0:misc_start[i+1]-m0]:
+                        key = strings[k]
+                        if v == _NO_VALUE:
+                            token_misc[key] = None
+                        elif v <= _STR_VALUE:
+                            token_misc[key] = strings[_STR_VALUE - v]
+                        else:
+                            values = token_misc.setdefault(key, set())
+                            if v != _EMPTY_SET:
+                                values.add(strings[v])
+                data = {'deprel':strings[deprel], 'deps':{},
+                        'feats':self._decode_feats(tuple(feats[feats_start[i]-f0:feats_start[i+1]-f0])),
+                        'form':strings[form], 'head':strings[head], 'id':strings[tok_id], 'lemma':strings[lemma],
+                        'misc':token_misc, 'upos':strings[upos], 'xpos':strings[xpos]}
+            nodes.append(Tree(data, None, []))
+        root = None
+        for i in sorted(range(len(cols)), key=lambda i : (cols[i][PARENT], cols[i][RANK])):
+            parent = cols[i][PARENT]
+            if parent < 0:
+                root = nodes[i]
+            else:
+                nodes[parent].add_child(nodes[i])
+        meta = self._sent_meta.get(j)
+        return ParsedSentence(root, strings[self.sent_ids[j]], strings[self.sent_texts[j]],
+                              _lists2sets(meta) if meta else {})
+
+    def _decode_feats(self, codes : Tuple[int, ...]) -> Dict:
+        if not codes:
+            return {}
+        items = self._feats_cache.get(codes)
+        if items is None:
+            grouped : Dict[str, List[str]] = {}
+            for c in codes:
+                key, value = self._pairs[c]
+                grouped.setdefault(key, []).append(value)
+            if self.interner is not None:
+                items = tuple((k, self.interner.frozen(v)) for k, v in grouped.items())
+            else:
+                items = tuple((k, tuple(v)) for k, v in grouped.items())
+            self._feats_cache[codes] = items
+        if self.interner is not None:
+            return dict(items)
+        return {k:set(v) for k, v in items}
+
+    def close(self):
+        # arrays handed out still reference the map, which is then closed when they are collected
+        self.tokens = self.feats = self.misc = None
+        self.doc_sentences = self.sent_tokens = self.sent_ids = self.sent_texts = None
+        self.feats_start = self.misc_start = None
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+        self._file.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+def load_corpus(filename : str, make_dict_id : bool = True, interner : Interner|None = INTERNER) -> ParsedDoc|DocList:
+    with CorpusFile(filename, interner) as corpus:
+        return corpus.read_all(make_dict_id)
+
+def json_zip_to_corpus(src : str, dst : str):
+    """Converts a .jz file written by ParsedDoc.to_json_zip or DocList.to_json_zip"""
+    with open(src, 'rb') as handle:
+        jsonable = json.loads(gzip.decompress(handle.read()).decode('utf-8'))
+    if isinstance(jsonable, list):
+        write_corpus(dst, DocList([ParsedDoc.from_jsonable(j, False) for j in jsonable]))
+    else:
+        write_corpus(dst, ParsedDoc.from_jsonable(jsonable, False))
+
+def corpus_to_json_zip(src : str, dst : str):
+    """Converts a corpus file back to the .jz file ParsedDoc.to_json_zip or DocList.to_json_zip would write"""
+    load_corpus(src, False).to_json_zip(dst)
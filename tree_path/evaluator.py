@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import List, Iterator, Dict
+from typing import List, Iterator, Iterable, Dict, Tuple, Set, FrozenSet
 
 
 from tree_path.tree import Tree
@@ -8,15 +8,28 @@ from tree_path.tree import Tree
 
 
 def _local_before(n1 : Tree, n2 : Tree) -> bool:
+    p1, p2 = n1._position, n2._position
+    if p1 is not None and p2 is not None:
+        return p1 < p2
     return float(n1._data['id']) < float(n2._data['id'])
 
 before = _local_before
 
 class Match:
+    __slots__ = ('node', 'next_nodes', '_metadata')
     def __init__(self, node : Tree, children : List[Match] = None):
         self.node = node
         self.next_nodes = children if children is not None else []
-        self.metadata = {}
+        self._metadata = None
+    @property
+    def metadata(self) -> Dict:
+        """Created on first access"""
+        if self._metadata is None:
+            self._metadata = {}
+        return self._metadata
+    @metadata.setter
+    def metadata(self, value : Dict):
+        self._metadata = value
     def data(self) -> Dict:
         return self.node._data
     def matches_level(self, depth) -> List[Match]:
@@ -39,6 +52,21 @@ class Match:
 class Evaluator:
     def evaluate(self, node : Tree) -> List[Match]|bool:
         pass
+    def exists(self, node : Tree) -> bool:
+        """Truth value of evaluate, without building Match objects"""
+        return bool(self.evaluate(node))
+    def count(self, node : Tree) -> int:
+        """Number of matches evaluate would return (1 for a true boolean), without building Match objects"""
+        return int(self.exists(node))
+    def iter(self, node : Tree) -> Iterator[Match]:
+        """Matches of evaluate, one at a time. A true boolean result yields a single Match of node"""
+        result = self.evaluate(node)
+        if isinstance(result, list):
+            yield from result
+        elif result:
+            yield Match(node)
+    def returns_list(self) -> bool:
+        return False
 
 class ConstantEvaluator(Evaluator):
     def __init__(self, value):
@@ -65,7 +93,7 @@ class ValueComparer(Evaluator):
             if self.operator == '?=': return True #[head_node]
             elif self.operator == '=': return False #[]
             else: raise Exception('Unknown operator ' + self.operator)
-        if not isinstance(tok_val, set):
+        if not isinstance(tok_val, (set, frozenset)):
             raise Exception('Value of %s is not a string or set -- %s' % ('.'.join(self.name), str(tok_val)))
         # is it a star * ?
         if '*' in self.value:
@@ -81,43 +109,98 @@ class ValueExpression(Evaluator):
         self.operator = operator
         self.left = left
         self.right = right
-    def evaluate(self, node : Tree) -> List[Match]|bool:        
+    def evaluate(self, node : Tree) -> List[Match]|bool:
+        if self.operator == '!':
+            return not self.left.exists(node)
         left_val = self.left.evaluate(node)
-        right_val = self.right.evaluate(node) if self.right else None
+        if self.operator == '&':
+            if not left_val:
+                return False
+            right_val = self.right.evaluate(node)
+            if not right_val:
+                return False
+        elif self.operator == '|':
+            # the right operand is only needed for its matches
+            if left_val and not self.right.returns_list():
+                return left_val if isinstance(left_val, list) else True
+            right_val = self.right.evaluate(node)
+            if not (left_val or right_val):
+                return False
+        else:
+            raise Exception('Unknown operator ' + self.operator)
         return_list = []
         return_list += left_val if isinstance(left_val, list) else []
         return_list += right_val if isinstance(right_val, list) else []
-        if self.operator == '|':
-            if left_val or right_val:
-                return  return_list if return_list else True # [Match(t) for t in return_list]
-            return False
+        return return_list if return_list else True # [Match(t) for t in return_list]
+    def exists(self, node : Tree) -> bool:
         if self.operator == '&':
-            if left_val and right_val:
-                return return_list if return_list else True
-            return False
+            return self.left.exists(node) and self.right.exists(node)
+        if self.operator == '|':
+            return self.left.exists(node) or self.right.exists(node)
         if self.operator == '!':
-            return not bool(left_val)
+            return not self.left.exists(node)
         raise Exception('Unknown operator ' + self.operator)
+    def returns_list(self) -> bool:
+        return self.operator != '!' and (self.left.returns_list() or self.right.returns_list())
     def __str__(self):
         return self.operator + '(' + self.left.__str__() + (' ' + self.right.__str__() if self.right else '') + ')'
     def __repr__(self):
         return self.__str__()
 
 
+def index_constraint(evaluator : Evaluator) -> Tuple[str, Set[str]]|None:
+    """A (key, values) comparison on one of Tree.INDEXED_KEYS that any node matching evaluator satisfies"""
+    if isinstance(evaluator, ValueComparer):
+        if evaluator.operator == '=' and len(evaluator.name) == 1 and evaluator.name[0] in Tree.INDEXED_KEYS \
+                and '*' not in evaluator.value:
+            return evaluator.name[0], frozenset(evaluator.value)
+        return None
+    if isinstance(evaluator, ValueExpression) and evaluator.operator == '&':
+        return index_constraint(evaluator.left) or index_constraint(evaluator.right)
+    return None
+
+Literal = Tuple[Tuple[str, ...], str] # (attribute path, value), value '*' for any value
+_MAX_CLAUSES = 16
+
+def required_literals(evaluator : Evaluator) -> List[FrozenSet[Literal]]:
+    """Clauses of literals, one of each clause being true of some node of any sentence the evaluator matches in.
+    Nodes tested by an evaluator are all in the sentence it is applied to, so each = comparison a match depends
+    on gives a clause of its values. An empty list means no literal is required"""
+    if isinstance(evaluator, ValueComparer):
+        if evaluator.operator != '=':
+            return []
+        path = tuple(evaluator.name)
+        if '*' in evaluator.value:
+            return [frozenset({(path, '*')})]
+        return [frozenset((path, v) for v in evaluator.value)]
+    if isinstance(evaluator, NodeEvaluator):
+        return required_literals(evaluator.evaluator)
+    if isinstance(evaluator, ValueExpression):
+        if evaluator.operator == '&':
+            return list(set(required_literals(evaluator.left) + required_literals(evaluator.right)))
+        if evaluator.operator == '|':
+            left, right = required_literals(evaluator.left), required_literals(evaluator.right)
+            if not left or not right or len(left) * len(right) > _MAX_CLAUSES:
+                return []
+            # (a & b) | c requires (a | c) & (b | c)
+            return list({l | r for l in left for r in right})
+    return []
+
+
 class NodeEvaluator(Evaluator):
     def __init__(self, path_type : str, evaluator : Evaluator, list_return = False ):
         self.path_type = path_type
         self.evaluator = evaluator
         self.list_return = list_return
-    def evaluate(self, node : Tree) -> List[Match]|bool:
-        if not node:
-            return False
+        # children candidates are taken from the child index when the evaluator requires an indexed value
+        self.index_constraint = index_constraint(evaluator) if path_type == '/' else None
+    def candidates(self, node : Tree) -> Iterable[Tree]:
         if self.path_type == '../': # parent
             node_list = [node.parent]
         elif self.path_type == '/': # children
-            node_list = node.children()
+            node_list = node.children_with(*self.index_constraint) if self.index_constraint else node.children()
         elif self.path_type == '//': # all descendants
-            node_list = [c for c in node.traverse() if c is not node]
+            node_list = node.descendants()
         elif self.path_type == './': # children plus self
             node_list = [node] + node.children()
         elif self.path_type == './/': # all descendants plus self
@@ -130,17 +213,47 @@ class NodeEvaluator(Evaluator):
             node_list = [child for child in node.children() if not before(child, node)]
         else:
             raise Exception("Unkown path " + str(self.path_type))
+        return node_list
+    def evaluate(self, node : Tree) -> List[Match]|bool:
+        if not self.list_return:
+            return self.exists(node)
+        if not node:
+            return False
         return_list = []
-        for candidate in node_list:
+        for candidate in self.candidates(node):
             eval = self.evaluator.evaluate(candidate)
             if not eval:
                 continue
             if not isinstance(eval, list):               
                 eval = []
             return_list.append(Match(candidate, eval))
-        if self.list_return:            
-            return return_list
-        return bool(return_list)
+        return return_list
+    def iter(self, node : Tree) -> Iterator[Match]:
+        if not self.list_return:
+            yield from super().iter(node)
+            return
+        if not node:
+            return
+        for candidate in self.candidates(node):
+            eval = self.evaluator.evaluate(candidate)
+            if not eval:
+                continue
+            yield Match(candidate, eval if isinstance(eval, list) else [])
+    def exists(self, node : Tree) -> bool:
+        if not node:
+            return False
+        for candidate in self.candidates(node):
+            if self.evaluator.exists(candidate):
+                return True
+        return False
+    def count(self, node : Tree) -> int:
+        if not self.list_return:
+            return int(self.exists(node))
+        if not node:
+            return 0
+        return sum(1 for candidate in self.candidates(node) if self.evaluator.exists(candidate))
+    def returns_list(self) -> bool:
+        return self.list_return
     
     def __str__(self):
         return self.path_type + '[' + self.evaluator.__str__() + ']'
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import sys
+from typing import Dict, Iterable, FrozenSet, Tuple, List
+
+
+class Interner:
+    """Shares identical strings and feature value sets between tokens.
+    Feature values become frozensets shared by all tokens having them; other value sets (misc)
+    stay mutable but their strings are shared. Counts the memory the duplicates would have taken.
+    The parsed feats columns kept for the CoNLL-U reader are dropped when there are more than max_feats_columns"""
+    def __init__(self, max_feats_columns : int = 1 << 16):
+        self._strings : Dict[str, str] = {}
+        # value set -> (shared frozenset, bytes a duplicate takes)
+        self._sets : Dict[FrozenSet[str], Tuple[FrozenSet[str], int]] = {}
+        self.shared = 0
+        self.saved_bytes = 0
+        # parsed feats columns of the CoNLL-U reader -> (feature, shared frozenset) pairs, bytes a duplicate takes
+        self.feats_columns : Dict[str, Tuple[Tuple[Tuple[str, FrozenSet[str]], ...], int]] = {}
+        self.max_feats_columns = max_feats_columns
+    def string(self, s : str) -> str:
+        interned = self._strings.setdefault(s, s)
+        if interned is not s:
+            self.shared += 1
+            self.saved_bytes += sys.getsizeof(s)
+        return interned
+    def strings(self, values : List[str|None]) -> List[str|None]:
+        """string() of each value, None left as is"""
+        strings = self._strings
+        interned = []
+        for s in values:
+            if s is not None:
+                i = strings.setdefault(s, s)
+                if i is not s:
+                    self.shared += 1
+                    self.saved_bytes += sys.getsizeof(s)
+                s = i
+            interned.append(s)
+        return interned
+    def frozen(self, values : Iterable[str]) -> FrozenSet[str]:
+        """Shared frozenset of values"""
+        key = values if isinstance(values, frozenset) else frozenset(values)
+        found = self._sets.get(key)
+        if found is None:
+            interned = frozenset(self.string(v) for v in values)
+            # a duplicate would hold its own set and strings
+            found = self._sets[interned] = (interned, sys.getsizeof(interned) + sum(map(sys.getsizeof, interned)))
+            return found[0]
+        if found[0] is not values:
+            self.shared += 1
+            self.saved_bytes += found[1]
+        return found[0]
+    def add_feats_column(self, column : str, parsed : Tuple[Tuple[Tuple[str, FrozenSet[str]], ...], int]):
+        if len(self.feats_columns) >= self.max_feats_columns:
+            self.feats_columns.clear()
+        self.feats_columns[column] = parsed
+    def token(self, data : Dict) -> Dict:
+        """Copy of token data with interned keys and strings, lists turned to sets as _lists2sets does,
+        and feats values turned to shared frozensets"""
+        strings = self._strings
+        token = {}
+        for k, v in data.items():
+            k = strings.setdefault(k, k)
+            if v.__class__ is str:
+                token[k] = self.string(v)
+            elif k == 'feats' and isinstance(v, dict):
+                token[k] = {strings.setdefault(f, f):(self.frozen(x) if isinstance(x, (set, frozenset, list))
+                                                      else self._value(x)) for f, x in v.items()}
+            else:
+                token[k] = self._value(v)
+        return token
+    def _value(self, v):
+        if isinstance(v, str):
+            return self.string(v)
+        if isinstance(v, (set, list)):
+            return {self.string(x) if isinstance(x, str) else x for x in v}
+        if isinstance(v, dict):
+            return {self._strings.setdefault(k, k) if isinstance(k, str) else k:self._value(x) for k, x in v.items()}
+        return v
+    def info(self) -> Dict[str, int]:
+        return {'strings':len(self._strings), 'sets':len(self._sets), 'shared':self.shared, 'saved_bytes':self.saved_bytes}
+    def report(self) -> str:
+        return '%d strings and %d feature value sets interned, %d duplicates shared, %.1f MB saved' % \
+            (len(self._strings), len(self._sets), self.shared, self.saved_bytes / 1e6)
+    def clear(self):
+        self.__init__(self.max_feats_columns)
+
+INTERNER = Interner()
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import itertools
+from typing import List, Dict, Iterator, Iterable, FrozenSet
+
+import numpy as np
+
+from tree_path.tree import Tree
+from tree_path.evaluator import Match, Literal
+from tree_path.search import Search
+
+
+LITERAL_KEYS = ('lemma', 'upos', 'deprel', 'feats', 'misc')
+
+def token_literals(data : Dict, keys : Iterable[str] = LITERAL_KEYS) -> Iterator[Literal]:
+    """Literals of the token data at keys. Value lists are taken as sets, as in the json of a Tree"""
+    for key in keys:
+        value = data.get(key)
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            for feature, values in value.items():
+                if values is None: # no value, compares false even to *
+                    continue
+                path = (key, feature)
+                yield path, '*'
+                if isinstance(values, str):
+                    yield path, values
+                elif isinstance(values, (set, frozenset, list)):
+                    for v in values:
+                        yield path, v
+        elif isinstance(value, str):
+            yield (key,), value
+        elif isinstance(value, (set, frozenset, list)):
+            for v in value:
+                yield (key,), v
+
+def is_indexed(literal : Literal, keys : Iterable[str]) -> bool:
+    """Whether token_literals gives literal when the token has it"""
+    path, value = literal
+    if len(path) == 2:
+        return path[0] in keys and path[0] in ('feats', 'misc')
+    return len(path) == 1 and path[0] in keys and value != '*'
+
+
+class InvertedIndex:
+    """Sentences of a list of documents by the (attribute path, value) literals of their nodes, e.g.
+    (('lemma',), 'putea') or (('misc', 'Ellipsis'), 'VPE'). Feats and misc features also have a (path, '*')
+    literal, for any value. search() only evaluates the sentences having the literals the expression requires.
+    The index is not updated when the documents change"""
+    KEYS = LITERAL_KEYS
+    def __init__(self, docs : Iterable[Iterable[Tree]], keys : Iterable[str] = KEYS):
+        """docs is a DocList, or any sequence of ParsedDocs"""
+        self.keys = tuple(keys)
+        self.sentences : List[Tree] = []
+        postings : Dict[Literal, List[int]] = {}
+        for doc in docs:
+            for sentence in doc:
+                i = len(self.sentences)
+                self.sentences.append(sentence)
+                for literal in self._sentence_literals(sentence):
+                    postings.setdefault(literal, []).append(i)
+        self.postings : Dict[Literal, np.ndarray] = {k:np.array(v, dtype=np.int32) for k, v in postings.items()}
+        self._all = np.arange(len(self.sentences), dtype=np.int32)
+
+    def _sentence_literals(self, sentence : Tree) -> set:
+        literals = set()
+        for node in sentence.traverse():
+            literals.update(token_literals(node._data, self.keys))
+        return literals
+
+    def __len__(self):
+        return len(self.sentences)
+    def is_indexed(self, literal : Literal) -> bool:
+        return is_indexed(literal, self.keys)
+    def posting(self, literal : Literal) -> np.ndarray:
+        """Positions of the sentences having literal, in order"""
+        return self.postings.get(literal, self._all[:0])
+
+    def candidates(self, expr : str|Search) -> np.ndarray:
+        """Positions of the sentences that may have matches, in order. Sentences lacking all the literals
+        of a clause the expression requires are left out, clauses with literals not indexed are ignored"""
+        search = expr if isinstance(expr, Search) else Search(expr)
+        clauses = [c for c in search.required_literals() if all(self.is_indexed(l) for l in c)]
+        if not clauses:
+            return self._all
+        # the rarest clauses first, so that the intersection shrinks fast
+        sentence_sets = sorted((self._clause_sentences(c) for c in clauses), key=len)
+        found = sentence_sets[0]
+        for sentences in sentence_sets[1:]:
+            if not len(found):
+                break
+            found = np.intersect1d(found, sentences, assume_unique=True)
+        return found
+    def _clause_sentences(self, clause : FrozenSet[Literal]) -> np.ndarray:
+        postings = [self.posting(l) for l in clause]
+        if len(postings) == 1:
+            return postings[0]
+        return np.unique(np.concatenate(postings))
+
+    def candidate_sentences(self, expr : str|Search) -> Iterator[Tree]:
+        return (self.sentences[i] for i in self.candidates(expr).tolist())
+    def search(self, expr : str|Search, limit : int = None) -> Iterator[Match]:
+        """Same matches as searching all the sentences in order. Stops after limit matches if given"""
+        search = expr if isinstance(expr, Search) else Search(expr)
+        matches = (m for s in self.candidate_sentences(search) for m in search.iter(s))
+        return matches if limit is None else itertools.islice(matches, limit)
+    def info(self) -> Dict[str, int]:
+        return {'sentences':len(self.sentences), 'literals':len(self.postings),
+                'postings':sum(len(p) for p in self.postings.values()),
+                'nbytes':sum(p.nbytes for p in self.postings.values())}
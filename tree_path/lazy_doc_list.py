@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import itertools
+from collections import OrderedDict
+from typing import List, Dict, Iterator
+
+from tree_path import Tree, Search, Match, ParsedSentence
+from tree_path.conllu import sent_tok_id_from_unique
+from tree_path.parsed_doc import ParsedDoc
+from tree_path.corpus_file import CorpusFile
+from tree_path.interning import Interner, INTERNER
+
+
+class LazyDocList:
+    """DocList over a corpus file (see write_corpus), reading sentences when they are first needed.
+    get_node_by_uid and sentence() read a single sentence; the last cache_size sentences read so are kept,
+    older ones are dropped and read again if needed. Indexing and iteration read whole documents, and search
+    reads one sentence at a time, without going through the cache.
+    Sentences and documents of a lazy list are frozen, since changes would be lost when they are dropped"""
+    def __init__(self, filename : str, cache_size : int = 1024, interner : Interner|None = INTERNER):
+        self.corpus = CorpusFile(filename, interner)
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache : OrderedDict[int, ParsedSentence] = OrderedDict()
+        self.doc_ids : List[str] = self.corpus.doc_ids
+        self.doc_index : Dict[str, int] = {doc_id:i for i, doc_id in enumerate(self.doc_ids)}
+        # same as DocList._doc_trie, with document indexes
+        self._doc_trie : Dict = {}
+        for doc_id, i in self.doc_index.items():
+            if doc_id is None:
+                continue
+            node = self._doc_trie
+            for part in doc_id.split('-'):
+                node = node.setdefault(part, {})
+            node[None] = i
+        # sent_id -> global sentence number, per document, built on first use
+        self._sentence_numbers : Dict[int, Dict[str, int]] = {}
+
+    def __len__(self):
+        return len(self.doc_ids)
+    def __getitem__(self, i : int) -> ParsedDoc:
+        """Document i, read whole"""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Document index out of range')
+        doc = self.corpus.read_doc(i)
+        doc.freeze()
+        return doc
+    def __iter__(self) -> Iterator[ParsedDoc]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def sentence(self, j : int) -> ParsedSentence:
+        """Sentence j, counting the sentences of all documents, through the cache"""
+        sentence = self._cache.get(j)
+        if sentence is not None:
+            self.hits += 1
+            self._cache.move_to_end(j)
+            return sentence
+        self.misses += 1
+        sentence = self.corpus.read_sentence(j)
+        sentence.freeze()
+        self._cache[j] = sentence
+        self._trim()
+        return sentence
+    def sentence_number(self, doc_index : int, sent_id : str) -> int|None:
+        """Global number of the sentence sent_id of document doc_index"""
+        numbers = self._sentence_numbers.get(doc_index)
+        if numbers is None:
+            sentences = self.corpus.doc_sentence_range(doc_index)
+            numbers = {}
+            for j in sentences:
+                numbers.setdefault(self.corpus.sentence_id(j), j)
+            self._sentence_numbers[doc_index] = numbers
+        return numbers.get(sent_id)
+
+    def doc(self, doc_id : str) -> ParsedDoc|None:
+        i = self.doc_index.get(doc_id)
+        return self[i] if i is not None else None
+    def _doc_number(self, uid : str) -> int|None:
+        """Index of the document whose id is the shortest dash-separated proper prefix of uid, as DocList.get_doc.
+        A file holding a single document also takes uids without the doc id"""
+        node = self._doc_trie
+        for part in uid.split('-')[:-1]:
+            node = node.get(part)
+            if node is None:
+                break
+            if None in node:
+                return node[None]
+        if self.corpus.single_doc:
+            return 0
+        return None
+    def get_doc(self, uid : str) -> ParsedDoc|None:
+        """Document of uid, read whole, see _doc_number"""
+        i = self._doc_number(uid)
+        return self[i] if i is not None else None
+    def get_node_by_uid(self, uid : str) -> Tree|None:
+        """Node of uid, reading only its sentence"""
+        i = self._doc_number(uid)
+        if i is None:
+            return None
+        doc_id = self.doc_ids[i]
+        if doc_id and uid.startswith(doc_id + '-'):
+            uid = uid[len(doc_id + '-'):] # slice off doc id
+        sent_id, node_id = sent_tok_id_from_unique(uid)
+        j = self.sentence_number(i, sent_id)
+        return self.sentence(j).node_dict.get(node_id) if j is not None else None
+    def search(self, expr : str|Search, limit : int = None) -> Iterator[Match]:
+        """Matches in all documents, evaluated lazily, one sentence at a time. Stops after limit matches if given"""
+        search = expr if isinstance(expr, Search) else Search(expr)
+        matches = (m for j in range(self.corpus.sentence_count()) for m in search.iter(self.corpus.read_sentence(j)))
+        return matches if limit is None else itertools.islice(matches, limit)
+
+    def resize(self, cache_size : int):
+        self.cache_size = cache_size
+        self._trim()
+    def _trim(self):
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+    def info(self) -> Dict[str, int]:
+        return {'hits':self.hits, 'misses':self.misses, 'size':len(self._cache), 'cache_size':self.cache_size}
+    def close(self):
+        self._cache.clear()
+        self.corpus.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
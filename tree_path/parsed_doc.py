@@ -1,15 +1,24 @@
 from __future__ import annotations
 
+import bisect
+import concurrent.futures
 import gzip
+import itertools
 import json
+import os
 from collections import defaultdict
-from typing import List, Dict, Iterator, Set
+from typing import List, Dict, Iterator, Set, Iterable, Tuple, Any
 
 import pyconll
 
 import tree_path
 from tree_path import Tree, Search, Match, ParsedSentence
-from tree_path.conllu import from_conllu
+from tree_path.conllu import from_conllu, sent_tok_id_from_unique
+from tree_path.interning import Interner, INTERNER
+from tree_path.inverted_index import InvertedIndex
+from tree_path.signatures import SentenceSignatures
+from tree_path.conllu_reader import RawSentence, iter_raw_from_file, iter_raw_from_range, document_offsets, gc_paused, \
+    SentenceIndex
 
 
 
@@ -20,6 +29,10 @@ class ParsedDoc(List[ParsedSentence]):
         super().__init__()
         self.doc_id = doc_id
         self.id_dict : Dict[str, ParsedSentence] = None
+        # index of each sentence, by id() since sentences may be shared with other documents, and the position
+        # of the first token of each sentence, built by make_positions
+        self._sentence_indexes : Dict[int, int] = {}
+        self._token_offsets : List[int] = []
         self.meta_data = meta_data if meta_data else {}
     def conllu(self, doc_id_key : str = '') -> str:
         """If not doc_id_key, no newdoc id will be entered"""
@@ -33,52 +46,69 @@ class ParsedDoc(List[ParsedSentence]):
         return c
     def make_id_dict(self):
         self.id_dict = {t.sent_id : t for t in self }      #(t,i) for t,i in zip(self, range(len(self)))}
+        self.make_positions()
+    def make_positions(self):
+        """Stores the index of each sentence in the document and the position of its first token"""
+        self._sentence_indexes = {}
+        for i, s in enumerate(self):
+            self._sentence_indexes.setdefault(id(s), i)
+        self._token_offsets = list(itertools.accumulate((len(s.node_list) for s in self), initial=0))
+    def sentence_index(self, s : ParsedSentence) -> int:
+        """Same as self.index(s). Positions are recomputed if the sentences have been added, removed
+        or moved since make_positions"""
+        i = self._sentence_indexes.get(id(s))
+        if i is None or i >= len(self) or self[i] is not s or len(self._token_offsets) != len(self) + 1:
+            self.make_positions()
+            i = self._sentence_indexes.get(id(s))
+            if i is None:
+                raise ValueError('Sentence %s is not in document %s' % (s.sent_id, self.doc_id))
+        return i
+    def token_position(self, node : Tree) -> int:
+        """Linear position of node among all tokens of the document"""
+        return self._token_offsets[self.sentence_index(node.root())] + node._position
+    def freeze(self):
+        """Freezes all sentences, see Tree.freeze"""
+        for s in self:
+            s.freeze()
     def sentence(self, sent_id : str):
         if self.id_dict is None: self.make_id_dict()
         return self.id_dict.get(sent_id)
+    def _contains(self, s : Tree) -> bool:
+        if self.id_dict is None: self.make_id_dict()
+        return self.id_dict.get(getattr(s, 'sent_id', None)) is s or s in self
     def root(self, n : Tree) -> ParsedSentence | None:
         n = n.root()
-        if n in self:
+        if self._contains(n):
             return n
         return None
         
-    def search(self, expr : str) -> Iterator[Match]:
-        search = Search(expr)
-        # matches = []
-        for s in self:
-            matches = search.find(s)
-            while matches:
-                yield matches[0]
-                matches.pop(0)
+    def search(self, expr : str|Search, limit : int = None) -> Iterator[Match]:
+        """Matches in all sentences, evaluated lazily. Stops after limit matches if given"""
+        search = expr if isinstance(expr, Search) else Search(expr)
+        matches = (m for s in self for m in search.iter(s))
+        return matches if limit is None else itertools.islice(matches, limit)
     
     def uid(self, node:Tree) -> str|None:
         s : ParsedSentence = node.root()
-        if s not in self: return None
+        if not self._contains(s): return None
         txt = s.uid(node)
         if self.doc_id:
             txt = self.doc_id + '-' + txt
         return txt
-    def get_node_by_uid(self, uid : str) -> Tree|None: #, ParsedSentence|None):
-        """Get node by its unique id. Also return sentence root"""
-        # (sent_id, node_id) = tree_path.conllu.sent_tok_id_from_unique(uid)
-        
-        # new method
+    def get_node_by_uid(self, uid : str) -> Tree|None:
+        """Get node by its unique id, with or without the doc id prefix"""
+        if self.id_dict is None: self.make_id_dict()
         if self.doc_id and uid.startswith(self.doc_id + '-'):
             uid = uid[len(self.doc_id + '-'):] # slice off doc id
-        (sent_id, node_id) = uid.rsplit('-', 1)
-        # end new method
-        if sent_id is None: return None, None
-        root = self.sentence(sent_id)
-        if not root: return (None, None)
-        node = root.search(lambda n : n._data['id'] == node_id)
-        node = node[0] if node else None
-        return node   #, root
+        sent_id, node_id = sent_tok_id_from_unique(uid)
+        sentence = self.id_dict.get(sent_id)
+        return sentence.node_dict.get(node_id) if sentence is not None else None
     
     def get_sentence_distance(self, sent_id_1 : str, sent_id_2 : str) -> int|None:
         if self.id_dict is None: self.make_id_dict()
         if sent_id_1 not in self.id_dict or sent_id_2 not in self.id_dict: return None
-        return self.index(self.id_dict[sent_id_2]) -\
-               self.index(self.id_dict[sent_id_1])
+        return self.sentence_index(self.id_dict[sent_id_2]) -\
+               self.sentence_index(self.id_dict[sent_id_1])
     
     def get_syntactic_distance(self, node_uid_1:str|Tree, node_uid_2:str|Tree,
                                sent_dist_fn=None) -> float:
@@ -116,23 +146,10 @@ class ParsedDoc(List[ParsedSentence]):
             s2 = n2.root()
         if not all([n1, s1, n2, s2]): return None
         if s1 == s2 and n1 == n2: return 0
-        s1_index = self.index(s1)
-        s2_index = self.index(s2)
-        n1_index = s1.node_list.index(n1)
-        n2_index = s2.node_list.index(n2)
-        if s1_index == s2_index:
-            return n2_index - n1_index
-        dir = 1 if s2_index > s1_index else -1
-        if dir == 1:
-            d1 = len(s1.node_list) - n1_index - 1
-            d2 = n2_index
-            between_range = range(s1_index+1, s2_index)
-        else:
-            d2 = len(s2.node_list) - n2_index - 1
-            d1 = n1_index
-            between_range = range(s2_index+1, s1_index)
-        d_between = sum([len(self[i].node_list) for i in between_range])
-        return dir * (d1 + d_between + d2)
+        distance = self.token_position(n2) - self.token_position(n1)
+        if s1 is not s2: # tokens strictly between the two, signed
+            distance -= 1 if distance > 0 else -1
+        return distance
     def token_iter(self) -> Iterator[Tree]:
         for sentence in self:
             for token in sentence.node_list:
@@ -155,25 +172,30 @@ class ParsedDoc(List[ParsedSentence]):
             return data
         with open(filename, 'wb') as handle:
             handle.write(data)
+    def to_corpus_file(self, filename : str):
+        """Binary columnar file, read back by tree_path.load_corpus"""
+        from tree_path.corpus_file import write_corpus
+        write_corpus(filename, self)
             
     @staticmethod
-    def from_jsonable(json_dict : Dict, make_dict_id : bool = True) -> ParsedDoc:
+    def from_jsonable(json_dict : Dict, make_dict_id : bool = True, interner : Interner|None = INTERNER) -> ParsedDoc:
         doc_id = json_dict['doc_id']
         meta_data = json_dict['meta_data']
         doc = ParsedDoc(doc_id, meta_data)
         for json_sentence in json_dict['sentences']:
-            doc.append(ParsedSentence.from_jsonable(json_sentence))
+            doc.append(ParsedSentence.from_jsonable(json_sentence, interner))
         if make_dict_id:
             doc.make_id_dict()
         return doc
     @staticmethod
-    def from_json_zip(src : bytes|str, make_dict_id : bool = True) -> ParsedDoc:
+    def from_json_zip(src : bytes|str, make_dict_id : bool = True, interner : Interner|None = INTERNER) -> ParsedDoc:
+        """Token strings and feature values are shared through interner, see interner.report()"""
         if isinstance(src, str): # it's a filename
             with open(src, 'rb') as handle:
                 src = handle.read()
         decomp = gzip.decompress(src)
         decoded = decomp.decode('utf-8')
-        doc = ParsedDoc.from_jsonable(json.loads(decoded))
+        doc = ParsedDoc.from_jsonable(json.loads(decoded), False, interner)
         if make_dict_id:
             doc.make_id_dict()
         return doc
@@ -186,14 +208,18 @@ class ParsedDoc(List[ParsedSentence]):
         return json_dict
 
 def iter_docs_from_conll(conll_in : str, doc_id_key : str, id_list : List[str] = '') -> Iterator[ParsedDoc]:
+    return _iter_docs(iter_raw_from_file(conll_in), doc_id_key, id_list)
+
+def _iter_docs(sentences : Iterable[RawSentence], doc_id_key : str, id_list : List[str] = '') -> Iterator[ParsedDoc]:
     tree_doc : ParsedDoc = ParsedDoc('')
-    for sentence in pyconll.iter_from_file(conll_in):
+    for sentence in sentences:
         if sentence.meta_present(doc_id_key):
             previous_doc = tree_doc
             tree_doc = ParsedDoc(sentence.meta_value(doc_id_key))
             meta_keys_skip = ('newdoc id', 'sent_id', 'text') 
-            tree_doc.meta_data = {k:v for k,v in sentence._meta.items() if k not in meta_keys_skip} # add meta data
+            tree_doc.meta_data = {k:v for k,v in sentence.meta.items() if k not in meta_keys_skip} # add meta data
             if previous_doc and (not id_list or previous_doc.doc_id in id_list):
+                previous_doc.make_id_dict()
                 yield previous_doc   
         sentence_tree = from_conllu(sentence)
         sentence_tree = ParsedSentence(sentence_tree, sentence.id, sentence.text)
@@ -209,48 +235,282 @@ class DocList(List[ParsedDoc]):
         super().__init__(doc_list)
         self.doc_dict = {}
         self.make_doc_dict()
+        self.inverted_index : InvertedIndex = None
     def make_doc_dict(self):
         self.doc_dict = {doc.doc_id:doc for doc in self}
+        # doc ids split at '-', nested; the document ending at a node is stored under None
+        self._doc_trie : Dict[str|None, Dict|ParsedDoc] = {}
+        for doc_id, doc in self.doc_dict.items():
+            node = self._doc_trie
+            for part in doc_id.split('-'):
+                node = node.setdefault(part, {})
+            node[None] = doc
     def get_doc(self, uid:str) -> ParsedDoc:
-        uid = uid.split('-')
-        for i in range(1, len(uid)):
-            doc_id = '-'.join(uid[0:i])
-            if doc_id in self.doc_dict:
-                return self.doc_dict[doc_id]
+        """Document whose id is the shortest dash-separated proper prefix of uid"""
+        node = self._doc_trie
+        for part in uid.split('-')[:-1]:
+            node = node.get(part)
+            if node is None:
+                return None
+            if None in node:
+                return node[None]
         return None
+    def make_index(self, keys : Iterable[str] = InvertedIndex.KEYS):
+        """Inverted index used by search to skip sentences. Call again after changing the documents"""
+        self.inverted_index = InvertedIndex(self, keys)
+    def search(self, expr : str|Search, limit : int = None) -> Iterator[Match]:
+        """Matches in all documents, evaluated lazily. Stops after limit matches if given"""
+        search = expr if isinstance(expr, Search) else Search(expr)
+        if self.inverted_index is not None:
+            return self.inverted_index.search(search, limit)
+        matches = (m for doc in self for m in doc.search(search))
+        return matches if limit is None else itertools.islice(matches, limit)
     def get_node_by_uid(self, uid:str) -> Tree|None:        
         doc = self.get_doc(uid)
         # if len(doc) != 1: raise Exception('Found %d docs named %s' % (len(doc), doc_id))
         # doc = doc[0]
-        return doc.get_node_by_uid(uid)
+        return doc.get_node_by_uid(uid) if doc is not None else None
         
     def to_conllu_file(self, outfile : str, doc_id_key = DOC_ID_KEY):
         with open(outfile, 'w', encoding='utf-8') as handle:
             for doc in self:
                 handle.write(doc.conllu(doc_id_key) + '\n')
     @staticmethod
-    def from_conllu(filename, doc_id_key : str = None):
+    def from_conllu(filename, doc_id_key : str = None, jobs : int = 1):
+        """With jobs > 1, the file is split at document starts and the pieces are parsed in a pool of jobs processes"""
         if doc_id_key is None:
             doc_id_key = DocList.DOC_ID_KEY
-        return DocList([d for d in iter_docs_from_conll(filename, doc_id_key)])
-    def to_json_zip(self, filename : str):
-        encoded = json.dumps([d.to_jsonable() for d in self])\
-            .encode('utf-8')
-        data = gzip.compress(encoded)
+        if jobs > 1:
+            return DocList(_load_parallel(filename, doc_id_key, jobs))
+        with gc_paused():
+            return DocList([d for d in iter_docs_from_conll(filename, doc_id_key)])
+    def to_json_zip(self, filename : str, signatures : bool = False):
+        """With signatures, the sentence signatures used by search_json_zip are saved next to the file"""
         if not filename:
-            return data
-        with open(filename, 'wb') as handle:
-            handle.write(data)
+            encoded = json.dumps([d.to_jsonable() for d in self])\
+                .encode('utf-8')
+            return gzip.compress(encoded)
+        write_json_zip(filename, self, signatures)
+    def to_corpus_file(self, filename : str):
+        from tree_path.corpus_file import write_corpus
+        write_corpus(filename, self)
     @staticmethod
-    def from_json_zip(src : bytes|str, make_dict_id : bool = True) -> DocList:
+    def from_json_zip(src : bytes|str, make_dict_id : bool = True, interner : Interner|None = INTERNER) -> DocList:
         if isinstance(src, str): # it's a filename
             with open(src, 'rb') as handle:
                 src = handle.read()
         decomp = gzip.decompress(src)
         decoded = decomp.decode('utf-8')
         json_list = json.loads(decoded) #ParsedDoc.from_jsonable(json.loads(decoded))
-        return DocList([ParsedDoc.from_jsonable(j, make_dict_id) for j in json_list])
+        return DocList([ParsedDoc.from_jsonable(j, make_dict_id, interner) for j in json_list])
+    @staticmethod
+    def search_json_zip(filename : str, expr : str|Search, limit : int = None,
+                        interner : Interner|None = INTERNER) -> Iterator[Match]:
+        """Matches in the sentences of a .jz file, streamed. Sentences whose signature (see signatures.py) rules
+        out a match are skipped before their tree is built. The signatures are computed and saved if needed"""
+        search = expr if isinstance(expr, Search) else Search(expr)
+        candidates = iter(SentenceSignatures.for_json_zip(filename).candidates(search).tolist() + [-1])
+        def matches():
+            next_candidate = next(candidates)
+            for i, json_sentence in enumerate(iter_json_zip_sentences(filename)):
+                if i != next_candidate:
+                    continue
+                next_candidate = next(candidates)
+                yield from search.iter(ParsedSentence.from_jsonable(json_sentence, interner))
+        return matches() if limit is None else itertools.islice(matches(), limit)
+    @staticmethod
+    def iter_json_zip(filename : str, make_dict_id : bool = True, interner : Interner|None = INTERNER) -> Iterator[ParsedDoc]:
+        """Documents of a .jz file, decompressed and parsed one at a time, their sentences built as they are read.
+        A file written by ParsedDoc.to_json_zip yields its single document"""
+        with gzip.open(filename, 'rt', encoding='utf-8') as handle:
+            for fields in _iter_json_docs(handle):
+                yield _doc_from_fields(fields, make_dict_id, interner)
+
+
+
+class JsonZipWriter:
+    """Writes documents to a .jz file as DocList.to_json_zip does, one at a time.
+    With signatures, the sentence signatures used by DocList.search_json_zip are saved next to the file.
+    Used in a with block, the file is deleted if the block raises, so that no truncated corpus is left"""
+    def __init__(self, filename : str, signatures : bool = False):
+        self.filename = filename
+        self._handle = gzip.open(filename, 'wt', encoding='utf-8')
+        self._handle.write('[')
+        self.count = 0
+        self.signatures = SentenceSignatures() if signatures else None
+    def write(self, doc : ParsedDoc):
+        if self.count:
+            self._handle.write(', ')
+        self._handle.write(json.dumps(doc.to_jsonable()))
+        self.count += 1
+        if self.signatures is not None:
+            for s in doc:
+                self.signatures.add_tree(s)
+    def close(self):
+        if not self._handle.closed:
+            self._handle.write(']')
+            self._handle.close()
+            if self.signatures is not None:
+                self.signatures._save_for(self.filename, os.stat(self.filename))
+    def abort(self):
+        """Closes and deletes the unfinished file, saving no signatures"""
+        if not self._handle.closed:
+            self._handle.close()
+            os.remove(self.filename)
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc, traceback):
+        """The file is finished if the block ran through, deleted if it raised"""
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_json_zip(filename : str, docs : Iterable[ParsedDoc], signatures : bool = False) -> int:
+    """Writes docs, which may be a generator, to a .jz file read by DocList.from_json_zip. Returns the number written"""
+    with JsonZipWriter(filename, signatures) as writer:
+        for doc in docs:
+            writer.write(doc)
+    return writer.count
+
+def iter_json_zip_sentences(filename : str) -> Iterator[Dict]:
+    """Json of the sentences of a .jz file, in order, decoded one at a time"""
+    with gzip.open(filename, 'rt', encoding='utf-8') as handle:
+        for fields in _iter_json_docs(handle):
+            for key, value in fields:
+                if key == 'sentences':
+                    yield from value
+
+_SPACE = ' \t\r\n'
+
+class _JsonStream:
+    """Reads json values from a text stream, buffering only what the value being decoded needs"""
+    def __init__(self, handle, chunk_size : int = 1 << 20):
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+    def more(self) -> bool:
+        # reads at least as much as is buffered, so that a value is parsed again only log(size) times
+        chunk = self.handle.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        self.buffer, self.pos = self.buffer[self.pos:] + chunk, 0
+        return bool(chunk)
+    def skip(self, chars : str = _SPACE) -> str:
+        """Skips chars, returns the next character, '' at the end of the stream"""
+        while True:
+            buffer = self.buffer
+            while self.pos < len(buffer) and buffer[self.pos] in chars:
+                self.pos += 1
+            if self.pos < len(buffer) or not self.more():
+                return self.buffer[self.pos] if self.pos < len(self.buffer) else ''
+    def decode(self):
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError:
+                if not self.more():
+                    raise
+    def iter_array(self) -> Iterator:
+        """Items of the array starting at the next character, decoded one at a time"""
+        self.skip()
+        self.pos += 1
+        while True:
+            c = self.skip(_SPACE + ',')
+            if c == ']':
+                self.pos += 1
+                return
+            if not c:
+                raise ValueError('Unterminated json array')
+            yield self.decode()
+    def iter_object(self, streamed : str) -> Iterator[Tuple[str, Any]]:
+        """(key, value) pairs of the object starting at the next character. The value of key streamed, if an array,
+        is given as an iterator over its items, which must be used up before the next pair is read"""
+        self.skip()
+        self.pos += 1
+        while True:
+            c = self.skip(_SPACE + ',')
+            if c == '}':
+                self.pos += 1
+                return
+            if not c:
+                raise ValueError('Unterminated json object')
+            key = self.decode()
+            if self.skip() != ':':
+                raise ValueError('Expected : after json key %s' % key)
+            self.pos += 1
+            if self.skip() == '[' and key == streamed:
+                items = self.iter_array()
+                yield key, items
+                for _ in items: # the rest, if not used
+                    pass
+            else:
+                yield key, self.decode()
+
+def _iter_json_docs(handle) -> Iterator[Iterator[Tuple[str, Any]]]:
+    """Fields of each document of a .jz stream, an array of documents or a single one, as (key, value) pairs.
+    The sentences are streamed, see _JsonStream.iter_object"""
+    stream = _JsonStream(handle)
+    if stream.skip() != '[':
+        yield stream.iter_object('sentences')
+        return
+    stream.pos += 1
+    while True:
+        c = stream.skip(_SPACE + ',')
+        if c == ']':
+            return
+        if not c:
+            raise ValueError('Unterminated json array')
+        yield stream.iter_object('sentences')
+
+def _doc_from_fields(fields : Iterator[Tuple[str, Any]], make_dict_id : bool, interner : Interner|None) -> ParsedDoc:
+    """Same as ParsedDoc.from_jsonable, building each sentence as its json is read"""
+    doc = ParsedDoc(None)
+    for key, value in fields:
+        if key == 'doc_id':
+            doc.doc_id = value
+        elif key == 'meta_data':
+            doc.meta_data = value if value else {}
+        elif key == 'sentences':
+            for json_sentence in value:
+                doc.append(ParsedSentence.from_jsonable(json_sentence, interner))
+    if make_dict_id:
+        doc.make_id_dict()
+    return doc
+
+def _load_parallel(filename : str, doc_id_key : str, jobs : int) -> List[ParsedDoc]:
+    size = os.path.getsize(filename)
+    offsets = document_offsets(filename, doc_id_key) if doc_id_key else []
+    # a few pieces per process, cut at the document starts nearest to equal byte shares
+    n_pieces = min(len(offsets) + 1, jobs * 4)
+    cuts = {0, size}
+    for i in range(1, n_pieces):
+        k = bisect.bisect_left(offsets, size * i // n_pieces)
+        if k < len(offsets):
+            cuts.add(offsets[k])
+    cuts = sorted(cuts)
+    pieces = [(filename, start, end, doc_id_key) for start, end in zip(cuts, cuts[1:])]
+    if len(pieces) < 2:
+        with gc_paused():
+            return [doc for piece in pieces for doc in _load_piece(piece)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(pieces))) as pool:
+        with gc_paused():
+            return [_reintern(doc, INTERNER) for docs in pool.map(_load_piece, pieces) for doc in docs]
+
+def _reintern(doc : ParsedDoc, interner : Interner) -> ParsedDoc:
+    """Shares the token strings and feature value sets of a document unpickled from a worker through interner,
+    since each worker pickles its own copies"""
+    for sentence in doc:
+        for node in sentence.node_list:
+            node._data = interner.token(node._data)
+        sentence.node_dict = {n._data['id']:n for n in sentence.node_list}
+    return doc
 
+def _load_piece(piece : Tuple[str, int, int, str]) -> List[ParsedDoc]:
+    filename, start, end, doc_id_key = piece
+    with gc_paused():
+        return list(_iter_docs(iter_raw_from_range(filename, start, end), doc_id_key))
 
 
 def display_uids_from_file(conllu_in: str, uid_dict : Dict[str, str]) -> List[str]:
@@ -259,7 +519,9 @@ def display_uids_from_file(conllu_in: str, uid_dict : Dict[str, str]) -> List[st
         sent_id, tok_id = tree_path.conllu.sent_tok_id_from_unique(uid)
         sent_tok_ids[sent_id][tok_id] = annot
     str_list = []
-    for sentence in pyconll.iter_from_file(conllu_in):
+    index = SentenceIndex.for_file(conllu_in)
+    texts = index.texts(index.select(sent_tok_ids, first_only=True))
+    for sentence in (s for text in texts for s in pyconll.load_from_string(text)):
         if sentence.id not in sent_tok_ids: continue
         sent_str = ''
         for token in sentence:
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import weakref
+from collections import Counter
+from typing import List, Dict, Tuple, Iterable
+
+from tree_path.tree import Tree
+from tree_path.evaluator import Evaluator, ValueComparer, ValueExpression, NodeEvaluator, ConstantEvaluator
+
+# Rewrites evaluator trees so that the conjuncts of each & run cheapest and most selective first.
+# The result of & is False if any conjunct is false, else the matches of its conjuncts in order. So conjuncts
+# returning no matches (value comparisons, negations, boolean subqueries) can run in any order before the
+# others, while conjuncts returning matches keep their order, and the same matches come out in the same order.
+
+_DEFAULT_SELECTIVITY = 0.5 # fraction of nodes passing a value comparison, without statistics
+
+
+class CorpusStatistics:
+    """Value frequencies per attribute and tree shape averages, used to estimate how many nodes
+    pass a comparison and how many candidates an axis gives"""
+    def __init__(self):
+        self.tokens = 0
+        self.sentences = 0
+        self.subtree_nodes = 0 # sum of subtree sizes, for the average number of descendants
+        self.values : Dict[Tuple[str, ...], Counter] = {} # attribute path -> value -> tokens having it
+        self.present : Counter = Counter() # attribute path -> tokens having a value for it
+        self.version = 0 # changed by every update, so that planners drop the plans made before
+
+    @staticmethod
+    def from_sentences(sentences : Iterable[Tree]) -> CorpusStatistics:
+        stats = CorpusStatistics()
+        for sentence in sentences:
+            stats.add_sentence(sentence)
+        return stats
+    @staticmethod
+    def from_docs(docs : Iterable[Iterable[Tree]]) -> CorpusStatistics:
+        """From a DocList, or any sequence of ParsedDocs"""
+        return CorpusStatistics.from_sentences(s for doc in docs for s in doc)
+
+    def add_sentence(self, root : Tree):
+        self.version += 1
+        self.sentences += 1
+        stack = [(root, 1)]
+        while stack:
+            node, depth = stack.pop()
+            self.tokens += 1
+            self.subtree_nodes += depth
+            self._add_values((), node._data)
+            stack.extend((child, depth + 1) for child in node.children())
+    def _add_values(self, path : Tuple[str, ...], data : Dict):
+        for k, v in data.items():
+            key = path + (k,)
+            if v is None:
+                continue
+            if isinstance(v, dict):
+                if not path:
+                    self._add_values(key, v)
+                continue
+            if isinstance(v, str):
+                v = (v,)
+            elif not isinstance(v, (set, frozenset, list, tuple)):
+                continue
+            self.present[key] += 1
+            counter = self.values.get(key)
+            if counter is None:
+                counter = self.values[key] = Counter()
+            counter.update(v)
+
+    def children_per_node(self) -> float:
+        return (self.tokens - self.sentences) / self.tokens if self.tokens else 1.0
+    def descendants_per_node(self) -> float:
+        return self.subtree_nodes / self.tokens - 1 if self.tokens else 1.0
+    def selectivity(self, comparer : ValueComparer) -> float:
+        """Estimated fraction of nodes for which the comparison is true"""
+        key = tuple(comparer.name)
+        if not self.tokens:
+            return _DEFAULT_SELECTIVITY
+        if key not in self.present: # no node has the attribute
+            return 1.0 if comparer.operator == '?=' else 0.0
+        present = self.present[key] / self.tokens
+        if '*' in comparer.value:
+            matching = present
+        else:
+            counter = self.values[key]
+            matching = min(present, sum(counter.get(v, 0) for v in comparer.value) / self.tokens)
+        if comparer.operator == '?=':
+            return 1.0 - present + matching
+        return matching
+
+
+class Planner:
+    """Reorders the & conjuncts of evaluator trees: value comparisons before subqueries, each ordered by
+    the selectivity estimated from the statistics, if given. Plans are kept per evaluator tree, until the
+    statistics are replaced or updated"""
+    def __init__(self, statistics : CorpusStatistics = None):
+        self.statistics = statistics
+        self._plans : weakref.WeakKeyDictionary[Evaluator, Evaluator] = weakref.WeakKeyDictionary()
+        self._planned_with : Tuple = (None, None) # statistics and their version the plans were made with
+
+    def plan(self, evaluator : Evaluator) -> Evaluator:
+        """Planned copy of the evaluator tree, which is left as it is (parsed trees are cached and shared).
+        The same copy is returned for the same tree, so that its compiled form is reused too"""
+        planned_with = (self.statistics, self.statistics.version if self.statistics is not None else None)
+        if planned_with[0] is not self._planned_with[0] or planned_with[1] != self._planned_with[1]:
+            self._plans.clear()
+            self._planned_with = planned_with
+        planned = self._plans.get(evaluator)
+        if planned is None:
+            planned = self._plans[evaluator] = self._plan(evaluator)[0]
+        return planned
+    def __getstate__(self):
+        return {'statistics':self.statistics}
+    def __setstate__(self, state):
+        self.__init__(state['statistics'])
+
+    def _plan(self, evaluator : Evaluator) -> Tuple[Evaluator, float, float]:
+        """Planned evaluator, its estimated cost per node and the probability that it is true"""
+        if isinstance(evaluator, ValueComparer):
+            return evaluator, 1.0, self._selectivity(evaluator)
+        if isinstance(evaluator, ConstantEvaluator):
+            return evaluator, 0.0, 1.0 if evaluator._value else 0.0
+        if isinstance(evaluator, NodeEvaluator):
+            inner, cost, p = self._plan(evaluator.evaluator)
+            fanout = self._fanout(evaluator.path_type)
+            p_any = 1.0 - (1.0 - p) ** fanout if p < 1.0 else 1.0
+            return NodeEvaluator(evaluator.path_type, inner, evaluator.list_return), 1.0 + fanout * cost, p_any
+        if isinstance(evaluator, ValueExpression):
+            if evaluator.operator == '!':
+                inner, cost, p = self._plan(evaluator.left)
+                return ValueExpression('!', inner), cost, 1.0 - p
+            if evaluator.operator == '|':
+                left, cost_l, p_l = self._plan(evaluator.left)
+                right, cost_r, p_r = self._plan(evaluator.right)
+                return ValueExpression('|', left, right), cost_l + (1.0 - p_l) * cost_r, 1.0 - (1.0 - p_l) * (1.0 - p_r)
+            if evaluator.operator == '&':
+                return self._plan_conjunction(evaluator)
+        return evaluator, 1.0, _DEFAULT_SELECTIVITY
+
+    def _plan_conjunction(self, evaluator : ValueExpression) -> Tuple[Evaluator, float, float]:
+        planned = [self._plan(c) for c in _conjuncts(evaluator)]
+        # conjuncts returning no matches first, value tests before those walking an axis,
+        # and in each group the one rejecting most nodes per unit of cost leading
+        filters = sorted((c for c in planned if not c[0].returns_list()), key=lambda c : (_has_axis(c[0]), _rank(c)))
+        ordered = filters + [c for c in planned if c[0].returns_list()]
+        cost, p = 0.0, 1.0
+        for _, c_cost, c_p in ordered:
+            cost += p * c_cost
+            p *= c_p
+        planned_tree = ordered[0][0]
+        for c in ordered[1:]:
+            planned_tree = ValueExpression('&', planned_tree, c[0])
+        return planned_tree, cost, p
+
+    def _selectivity(self, comparer : ValueComparer) -> float:
+        if self.statistics is None:
+            return _DEFAULT_SELECTIVITY
+        return self.statistics.selectivity(comparer)
+    def _fanout(self, path_type : str) -> float:
+        children = self.statistics.children_per_node() if self.statistics else 1.0
+        descendants = self.statistics.descendants_per_node() if self.statistics else 5.0
+        return {'../':1.0, '.':1.0, '/':children, './':1.0 + children, '<':children / 2, '>':children / 2,
+                '//':descendants, './/':1.0 + descendants}.get(path_type, children)
+
+
+def _conjuncts(evaluator : Evaluator) -> List[Evaluator]:
+    if isinstance(evaluator, ValueExpression) and evaluator.operator == '&':
+        return _conjuncts(evaluator.left) + _conjuncts(evaluator.right)
+    return [evaluator]
+
+def _has_axis(evaluator : Evaluator) -> bool:
+    if isinstance(evaluator, NodeEvaluator):
+        return True
+    if isinstance(evaluator, ValueExpression):
+        return _has_axis(evaluator.left) or (evaluator.right is not None and _has_axis(evaluator.right))
+    return False
+
+def _rank(planned : Tuple[Evaluator, float, float]) -> float:
+    _, cost, p = planned
+    return cost / (1.0 - p) if p < 1.0 else float('inf')
@@ -1,7 +1,11 @@
-from typing import List
+from collections import OrderedDict
+from typing import List, Dict, Iterator, FrozenSet
 
-from tree_path.evaluator import Evaluator, ValueComparer, ValueExpression, NodeEvaluator, ConstantEvaluator, Match
+from tree_path.evaluator import Evaluator, ValueComparer, ValueExpression, NodeEvaluator, ConstantEvaluator, Match, \
+    required_literals, Literal
 from tree_path.tree import Tree
+from tree_path.compiler import compile_evaluator
+from tree_path.planner import Planner
 
 _grammar = r"""
 
@@ -103,18 +107,92 @@ _g = None
 _parser = None
 
 
-class Search:
-    def __init__(self, expression : str):
-        self._expression = expression
+class _ExpressionCache:
+    """Bounded LRU map from expression string to parsed evaluator tree.
+    Evaluator trees are not modified by evaluation, so they can be shared between Search objects."""
+    def __init__(self, maxsize : int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries : OrderedDict[str, Evaluator] = OrderedDict()
+    def get(self, expression : str) -> Evaluator:
+        expr_tree = self._entries.get(expression)
+        if expr_tree is not None:
+            self.hits += 1
+            self._entries.move_to_end(expression)
+            return expr_tree
+        self.misses += 1
         try:
-            self._expr_tree : Evaluator = _parser.parse(expression)
+            expr_tree = _parser.parse(expression)
         except Exception as e:
             raise Exception('Parse error in expression %s: %s' % (expression, str(e)))
+        self._entries[expression] = expr_tree
+        self._trim()
+        return expr_tree
+    def resize(self, maxsize : int):
+        self.maxsize = maxsize
+        self._trim()
+    def _trim(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+    def info(self) -> Dict[str, int]:
+        return {'hits':self.hits, 'misses':self.misses, 'size':len(self._entries), 'maxsize':self.maxsize}
+
+_expression_cache = _ExpressionCache()
+
+
+class Search:
+    BACKENDS = ('interpreted', 'compiled')
+    def __init__(self, expression : str, backend : str = 'interpreted', planner : Planner = None):
+        """backend 'compiled' evaluates through a specialized Python function generated from the expression.
+        With a planner, the conjunctions are reordered for speed, with the same results, see planner.Planner"""
+        if backend not in Search.BACKENDS:
+            raise Exception('Unknown backend %s, expected one of %s' % (backend, ', '.join(Search.BACKENDS)))
+        self._expression = expression
+        self.backend = backend
+        self.planner = planner
+        self._expr_tree : Evaluator = Search.compile(expression)
+        if planner is not None:
+            self._expr_tree = planner.plan(self._expr_tree)
+        engine = self._expr_tree if backend == 'interpreted' else compile_evaluator(self._expr_tree)
+        self._evaluate = engine.evaluate
+        self._iter = engine.iter
+        self._exists = engine.exists
+        self._count = engine.count
+    @classmethod
+    def compile(cls, expression : str) -> Evaluator:
+        """Parsed evaluator tree for expression, taken from the process-wide cache if already parsed"""
+        return _expression_cache.get(expression)
+    @staticmethod
+    def cache_info() -> Dict[str, int]:
+        return _expression_cache.info()
+    @staticmethod
+    def cache_clear():
+        _expression_cache.clear()
+    @staticmethod
+    def set_cache_size(maxsize : int):
+        """maxsize 0 disables caching"""
+        _expression_cache.resize(maxsize)
     def find(self, tree : Tree) -> List[Match]:
-        return self._expr_tree.evaluate(tree)
+        return self._evaluate(tree)
+    def iter(self, tree : Tree) -> Iterator[Match]:
+        """Matches of find(tree), evaluated lazily as the caller consumes them"""
+        return self._iter(tree)
+    def exists(self, tree : Tree) -> bool:
+        """Same as bool(find(tree)), but stops at the first match and builds no Match objects"""
+        return self._exists(tree)
+    def count(self, tree : Tree) -> int:
+        """Number of matches find(tree) would return, without building Match objects"""
+        return self._count(tree)
+    def required_literals(self) -> List[FrozenSet[Literal]]:
+        """Clauses of (attribute path, value) literals a sentence must contain to have matches,
+        see evaluator.required_literals"""
+        return required_literals(self._expr_tree)
     def __str__(self):
         return str(self._expr_tree)
     def __repr__(self):
         return repr(str(self))
-
-
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from typing import List, Dict, Tuple
+
+from tree_path.tree import Tree
+from tree_path.evaluator import Evaluator, ValueComparer, ValueExpression, NodeEvaluator, ConstantEvaluator, Match
+from tree_path.search import Search
+
+
+def _key(evaluator : Evaluator) -> Tuple:
+    """Structural key, equal for evaluator trees that give the same results"""
+    if isinstance(evaluator, ValueComparer):
+        return 'value', evaluator.operator, tuple(evaluator.name), frozenset(evaluator.value)
+    if isinstance(evaluator, ValueExpression):
+        return 'expr', evaluator.operator, _key(evaluator.left), _key(evaluator.right) if evaluator.right else None
+    if isinstance(evaluator, NodeEvaluator):
+        return 'node', evaluator.path_type, evaluator.list_return, _key(evaluator.evaluator)
+    if isinstance(evaluator, ConstantEvaluator):
+        return 'const', evaluator._value
+    return 'other', id(evaluator)
+
+
+class _SharedEvaluator(Evaluator):
+    """Node axis subexpression used in several places of a SearchSet. Its exists() result for a node
+    is kept until the set starts on the next node"""
+    def __init__(self, evaluator : NodeEvaluator):
+        self.evaluator = evaluator
+        self.results : Dict[int, bool] = {}
+    def evaluate(self, node : Tree) -> List[Match]|bool:
+        return self.evaluator.evaluate(node)
+    def iter(self, node : Tree):
+        return self.evaluator.iter(node)
+    def exists(self, node : Tree) -> bool:
+        key = id(node)
+        found = self.results.get(key)
+        if found is None:
+            found = self.results[key] = self.evaluator.exists(node)
+        return found
+    def count(self, node : Tree) -> int:
+        return self.evaluator.count(node)
+    def returns_list(self) -> bool:
+        return self.evaluator.returns_list()
+    def __str__(self):
+        return str(self.evaluator)
+
+
+class SearchSet:
+    """Several Search expressions evaluated together on the same nodes.
+    Equal expressions are evaluated once, and node axis subexpressions occurring in several expressions
+    (e.g. the same /[deprel=X] test) are walked once per node. Results are per expression, in the order given"""
+    def __init__(self, expressions : List[str|Search]):
+        self.searches = [e if isinstance(e, Search) else Search(e) for e in expressions]
+        # count the uses of each subexpression, then rebuild the trees sharing those used more than once
+        self._uses : Dict[Tuple, int] = {}
+        for s in self.searches:
+            self._count_uses(s._expr_tree)
+        self._built : Dict[Tuple, Evaluator] = {}
+        self._shared : List[_SharedEvaluator] = []
+        roots = [self._build(s._expr_tree) for s in self.searches]
+        unique = {id(r):r for r in roots}
+        self._roots = list(unique.values())
+        positions = {id(r):i for i, r in enumerate(self._roots)}
+        self._positions = [positions[id(r)] for r in roots]
+
+    def _count_uses(self, evaluator : Evaluator):
+        key = _key(evaluator)
+        self._uses[key] = self._uses.get(key, 0) + 1
+        if self._uses[key] > 1:
+            return # its subexpressions are only walked once
+        if isinstance(evaluator, ValueExpression):
+            self._count_uses(evaluator.left)
+            if evaluator.right:
+                self._count_uses(evaluator.right)
+        elif isinstance(evaluator, NodeEvaluator):
+            self._count_uses(evaluator.evaluator)
+
+    def _build(self, evaluator : Evaluator) -> Evaluator:
+        """Copy of the evaluator tree with the shared subtrees. The parsed trees are left as they are,
+        since they are shared through the expression cache"""
+        key = _key(evaluator)
+        built = self._built.get(key)
+        if built is not None:
+            return built
+        if isinstance(evaluator, ValueExpression):
+            built = ValueExpression(evaluator.operator, self._build(evaluator.left),
+                                    self._build(evaluator.right) if evaluator.right else None)
+        elif isinstance(evaluator, NodeEvaluator):
+            built = NodeEvaluator(evaluator.path_type, self._build(evaluator.evaluator), evaluator.list_return)
+            if self._uses[key] > 1:
+                built = _SharedEvaluator(built)
+                self._shared.append(built)
+        else:
+            built = evaluator
+        self._built[key] = built
+        return built
+
+    def __len__(self):
+        return len(self.searches)
+    def shared_count(self) -> int:
+        """Number of node axis subexpressions shared between or within the expressions"""
+        return len(self._shared)
+
+    def _start(self):
+        for shared in self._shared:
+            shared.results.clear()
+    def exists(self, tree : Tree) -> List[bool]:
+        """Search.exists of each expression"""
+        self._start()
+        values = [root.exists(tree) for root in self._roots]
+        return [values[i] for i in self._positions]
+    def count(self, tree : Tree) -> List[int]:
+        """Search.count of each expression"""
+        self._start()
+        values = [root.count(tree) for root in self._roots]
+        return [values[i] for i in self._positions]
+    def find(self, tree : Tree) -> List[List[Match]|bool]:
+        """Search.find of each expression. Equal expressions get the same result list"""
+        self._start()
+        values = [root.evaluate(tree) for root in self._roots]
+        return [values[i] for i in self._positions]
+    def matching(self, tree : Tree) -> List[int]:
+        """Indexes of the expressions that match tree"""
+        return [i for i, found in enumerate(self.exists(tree)) if found]
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import struct
+from typing import List, Dict, Iterator, Iterable
+
+import numpy as np
+
+from tree_path.tree import Tree
+from tree_path.evaluator import Literal
+from tree_path.search import Search
+from tree_path.conllu_reader import SentenceIndex, RawSentence, iter_raw_sentences, iter_raw_from_file, parse_token
+from tree_path.inverted_index import token_literals, is_indexed, LITERAL_KEYS
+
+# Bloom filter signature of each sentence over the literals of its tokens (see inverted_index.token_literals).
+# A sentence lacking a literal required by an expression has no matches, and its signature tells so for all
+# but a small fraction of such sentences, without parsing it.
+# Sidecar file: MAGIC, header length (uint32), json header, padding to 8 bytes, uint64 array (sentences, words)
+
+MAGIC = b'TPSIG001'
+
+
+class SentenceSignatures:
+    """Bloom signatures of a sequence of sentences, in order. With the defaults, a signature takes 128 bytes and
+    a sentence of 100 distinct literals passes a test for a literal it lacks about 1% of the time"""
+    SUFFIX = '.tpsig'
+    def __init__(self, bits : int = 1024, hashes : int = 4, keys : Iterable[str] = LITERAL_KEYS):
+        if bits % 64:
+            raise ValueError('Signature bits must be a multiple of 64')
+        self.bits = bits
+        self.hashes = hashes
+        self.keys = tuple(keys)
+        self.source : Dict = {} # size and modification time of the file the signatures are of
+        self._masks : Dict[Literal, int] = {}
+        self._signatures : List[int] = []
+        self._words : np.ndarray = None
+
+    def mask(self, literal : Literal) -> int:
+        """Bits of the literal, as an int. The hash is stable between runs, unlike hash() of strings"""
+        mask = self._masks.get(literal)
+        if mask is None:
+            path, value = literal
+            digest = hashlib.blake2b(('\x1f'.join(path) + '\x1e' + value).encode('utf-8'), digest_size=8).digest()
+            h1, h2 = struct.unpack('<II', digest)
+            h2 |= 1
+            mask = 0
+            for i in range(self.hashes):
+                mask |= 1 << ((h1 + i * h2) % self.bits)
+            self._masks[literal] = mask
+        return mask
+
+    def add(self, tokens : Iterable[Dict]):
+        """Adds the signature of a sentence, given the data of its tokens"""
+        signature = 0
+        for data in tokens:
+            for literal in token_literals(data, self.keys):
+                signature |= self.mask(literal)
+        self._append(signature)
+    def add_any(self):
+        """Adds a signature passing all tests, for a sentence whose tokens could not be read"""
+        self._append((1 << self.bits) - 1)
+    def _append(self, signature : int):
+        if self._words is not None and len(self._signatures) != len(self._words):
+            # loaded from a file, the signatures are only in the array
+            self._signatures = [int.from_bytes(row.tobytes(), 'little') for row in self._words]
+        self._signatures.append(signature)
+        self._words = None
+    def add_tree(self, sentence : Tree):
+        self.add(node._data for node in sentence.traverse())
+
+    def __len__(self):
+        return len(self._signatures) if self._words is None else len(self._words)
+    def words(self) -> np.ndarray:
+        """Signatures as a (sentences, bits / 64) array"""
+        if self._words is None:
+            n_bytes = self.bits // 8
+            data = b''.join(s.to_bytes(n_bytes, 'little') for s in self._signatures)
+            self._words = np.frombuffer(data, dtype='<u8').reshape(-1, self.bits // 64)
+        return self._words
+    def _mask_words(self, literal : Literal) -> np.ndarray:
+        return np.frombuffer(self.mask(literal).to_bytes(self.bits // 8, 'little'), dtype='<u8')
+
+    def candidates(self, expr : str|Search) -> np.ndarray:
+        """Positions of the sentences that may have matches, in order"""
+        search = expr if isinstance(expr, Search) else Search(expr)
+        words = self.words()
+        passed = np.ones(len(words), dtype=bool)
+        for clause in search.required_literals():
+            if not all(is_indexed(l, self.keys) for l in clause):
+                continue
+            clause_passed = np.zeros(len(words), dtype=bool)
+            for literal in clause:
+                mask = self._mask_words(literal)
+                clause_passed |= ((words & mask) == mask).all(axis=1)
+            passed &= clause_passed
+        return np.flatnonzero(passed)
+
+    # sidecar files
+    def save(self, filename : str):
+        words = self.words()
+        header = json.dumps({'bits':self.bits, 'hashes':self.hashes, 'keys':self.keys, 'count':len(words),
+                             'source':self.source}).encode('utf-8')
+        with open(filename, 'wb') as handle:
+            handle.write(MAGIC + struct.pack('<I', len(header)) + header)
+            handle.write(b'\0' * (-handle.tell() % 8))
+            handle.write(words.tobytes())
+    @staticmethod
+    def load(filename : str) -> SentenceSignatures:
+        with open(filename, 'rb') as handle:
+            data = handle.read()
+        if data[:8] != MAGIC:
+            raise ValueError('%s is not a signature file' % filename)
+        length, = struct.unpack_from('<I', data, 8)
+        header = json.loads(data[12:12+length].decode('utf-8'))
+        signatures = SentenceSignatures(header['bits'], header['hashes'], header['keys'])
+        signatures.source = header['source']
+        offset = 12 + length + (-(12 + length) % 8)
+        signatures._words = np.frombuffer(data, dtype='<u8', offset=offset).reshape(header['count'], header['bits'] // 64)
+        return signatures
+    @staticmethod
+    def _saved(filename : str, bits : int, hashes : int, keys : Iterable[str]) -> SentenceSignatures|None:
+        """Signatures saved for filename, if up to date and made with the same parameters"""
+        try:
+            signatures = SentenceSignatures.load(filename + SentenceSignatures.SUFFIX)
+        except (OSError, ValueError, KeyError):
+            return None
+        if (signatures.bits, signatures.hashes, signatures.keys, signatures.source) != \
+                (bits, hashes, tuple(keys), _source(filename)):
+            return None
+        return signatures
+    def _save_for(self, filename : str, stat : os.stat_result):
+        self.source = _source(filename, stat)
+        try:
+            self.save(filename + SentenceSignatures.SUFFIX)
+        except OSError:
+            pass
+
+    @staticmethod
+    def for_conllu(filename : str, index : SentenceIndex = None, bits : int = 1024, hashes : int = 4,
+                   keys : Iterable[str] = LITERAL_KEYS) -> SentenceSignatures:
+        """Signatures of the sentences of the file's SentenceIndex, from the sidecar if it is up to date,
+        else computed (reading the tokens, without building trees) and saved"""
+        signatures = SentenceSignatures._saved(filename, bits, hashes, keys)
+        if signatures is not None:
+            return signatures
+        stat = os.stat(filename)
+        index = index if index is not None else SentenceIndex.for_file(filename)
+        signatures = SentenceSignatures(bits, hashes, keys)
+        for text in _iter_texts(index, range(len(index))):
+            try:
+                raws = iter_raw_sentences(text.split('\n'))
+                signatures.add(parse_token(line) for raw in raws for line in raw.lines)
+            except Exception:
+                signatures.add_any()
+        signatures._save_for(filename, stat)
+        return signatures
+
+    @staticmethod
+    def for_json_zip(filename : str, bits : int = 1024, hashes : int = 4,
+                     keys : Iterable[str] = LITERAL_KEYS) -> SentenceSignatures:
+        """Signatures of the sentences of a .jz file, in document order, from the sidecar if it is up to date,
+        else computed from the json (without building trees) and saved. See also JsonZipWriter"""
+        signatures = SentenceSignatures._saved(filename, bits, hashes, keys)
+        if signatures is not None:
+            return signatures
+        from tree_path.parsed_doc import iter_json_zip_sentences
+        stat = os.stat(filename)
+        signatures = SentenceSignatures(bits, hashes, keys)
+        for json_sentence in iter_json_zip_sentences(filename):
+            signatures.add(_json_tokens(json_sentence['node']))
+        signatures._save_for(filename, stat)
+        return signatures
+
+
+def _source(filename : str, stat : os.stat_result = None) -> Dict:
+    stat = stat if stat is not None else os.stat(filename)
+    return {'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns}
+
+def _json_tokens(json_node : Dict) -> Iterator[Dict]:
+    stack = [json_node]
+    while stack:
+        node = stack.pop()
+        yield node['_data']
+        stack.extend(node['children'])
+
+def _iter_texts(index : SentenceIndex, positions : Iterable[int], chunk : int = 1000) -> Iterator[str]:
+    positions = list(positions)
+    for i in range(0, len(positions), chunk):
+        yield from index.texts(positions[i:i+chunk])
+
+def iter_candidate_sentences(filename : str, expr : str|Search) -> Iterator[RawSentence]:
+    """Sentences of a CoNLL-U file that may match, in order, the others skipped by their signature unread"""
+    index = SentenceIndex.for_file(filename)
+    signatures = SentenceSignatures.for_conllu(filename, index)
+    candidates = signatures.candidates(expr)
+    if len(candidates) == len(index): # nothing skipped, read straight through
+        yield from iter_raw_from_file(filename)
+        return
+    for text in _iter_texts(index, candidates.tolist()):
+        yield from iter_raw_sentences(text.split('\n'))
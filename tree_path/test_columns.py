@@ -0,0 +1,64 @@
+"""Checks CorpusColumns against Search on a corpus: python -m tree_path.test_columns [file.jz] [sentences]"""
+import sys
+
+import tree_path as tp
+from tree_path import Search
+from tree_path.columns import CorpusColumns
+
+exprs = [
+    '/[deprel=cop]',
+    '/[deprel=cop,aux:pass]',
+    '.[upos=VERB /[deprel=cop]]',
+    './/[upos=VERB]/[upos=PRON,NOUN]/[upos=ADP,DET]',
+    './/[upos=VERB /[deprel=obj upos=NOUN,PROPN] /[deprel=nsubj upos=NOUN,PROPN] ]',
+    '/[deprel=xcomp (upos=VERB & !misc.Mood=Part | /[deprel=cop,aux:pass] ) ]',
+    '.[ /[deprel=obj] & !<[deprel=obj feats.PronType=Rel] ]',
+    '.[misc.Mood=Inf deprel=ccomp ../[lemma=putea,trebui] ]',
+    '<[deprel=advmod !lemma=nu]',
+    '>[deprel=obj]',
+    '/[feats.PronType=Rel | _lemma=orice | /[_lemma=cum,orice] ]',
+    './[deprel=nsubj]',
+    './[upos=VERB]',
+    './[*]',
+    './[upos=VERB,NOUN]/[deprel=obj]',
+    './[!deprel=punct /[*]]',
+    '/[deprel=conj /[deprel=cc]]/[deprel=ccomp]',
+    '.[(upos=VERB & !(deprel=aux)) | /[deprel=cop] | (upos=AUX & deprel=ccomp) ]',
+    '../[*]',
+    '../[!deprel=root]',
+    '!/[deprel=nsubj]',
+    '.[/[deprel=nsubj]/[*] | /[deprel=obj]]',
+    '/[*]/[*]',
+    './/[feats.Case?=Acc]/[deprel=case]',
+    '//[upos=*]',
+    './/[upos=VERB]',
+    './/[misc.Ellipsis=VPE]',
+    '/[deprel=nsubj] /[deprel=obj]',
+    '.[upos=VERB]//[upos=NOUN]>[upos=ADJ]',
+]
+
+def key(m : tp.Match):
+    if m.node is None:
+        return None
+    return m.node.root().sent_id, m.node._data['id'], [key(x) for x in m.next_nodes]
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'rrt-all.3.annot.4.jz'
+    doc = tp.ParsedDoc.from_json_zip(filename)
+    if len(sys.argv) > 2:
+        del doc[int(sys.argv[2]):]
+        doc.make_id_dict()
+    columns = CorpusColumns(doc)
+    failed = 0
+    for e in exprs:
+        search = Search(e)
+        checks = {
+            'search':[key(m) for m in columns.search(e)] == [key(m) for s in doc for m in search.iter(s)],
+            'count':columns.count(e) == sum(search.count(s) for s in doc),
+            'matching':[s.sent_id for s in columns.matching_sentences(e)] == [s.sent_id for s in doc if search.exists(s)],
+        }
+        bad = [k for k, ok in checks.items() if not ok]
+        failed += bool(bad)
+        print('FAIL' if bad else 'ok  ', e, ' '.join(bad))
+    print('%d of %d expressions failed' % (failed, len(exprs)))
+    sys.exit(1 if failed else 0)
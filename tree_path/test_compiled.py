@@ -0,0 +1,85 @@
+"""Checks the compiled Search backend against the interpreted one on every node of a corpus:
+python -m tree_path.test_compiled [file.jz] [sentences]"""
+import sys
+
+import tree_path as tp
+from tree_path import Search
+
+exprs = [
+    # axes
+    '.[upos=VERB]',
+    '/[deprel=nsubj]',
+    '//[upos=NOUN]',
+    './[upos=VERB]',
+    './/[upos=VERB]',
+    '../[upos=VERB]',
+    '<[deprel=advmod]',
+    '>[deprel=obj]',
+    './/[upos=VERB]/[upos=PRON,NOUN]/[upos=ADP,DET]',
+    '.[upos=VERB]//[upos=NOUN]>[upos=ADJ]',
+    '/[*]/[*]',
+    '../[*]',
+    '//[upos=*]',
+    # comparisons
+    '/[deprel=cop,aux:pass]',
+    '/[feats.Case?=Acc]',
+    './/[feats.Case?=Acc]/[deprel=case]',
+    './/[feats.PronType=*]',
+    './/[misc.Ellipsis=VPE]',
+    '.[misc.Mood=Inf deprel=ccomp ../[lemma=putea,trebui] ]',
+    '/[_lemma=cum,orice]',
+    '/[nosuchkey=x]',
+    '/[feats.NoSuchFeat?=x]',
+    # & and |, explicit and implicit
+    '/[deprel=nsubj] /[deprel=obj]',
+    '.[upos=VERB & deprel=root]',
+    '.[upos=VERB deprel=root]',
+    '.[upos=VERB | upos=AUX]',
+    '/[feats.PronType=Rel | _lemma=orice | /[_lemma=cum,orice] ]',
+    '.[(upos=VERB & !(deprel=aux)) | /[deprel=cop] | (upos=AUX & deprel=ccomp) ]',
+    './/[upos=VERB /[deprel=obj upos=NOUN,PROPN] /[deprel=nsubj upos=NOUN,PROPN] ]',
+    '/[deprel=conj /[deprel=cc]]/[deprel=ccomp]',
+    '.[/[deprel=nsubj]/[*] | /[deprel=obj]]',
+    # ! forms
+    '!/[deprel=nsubj]',
+    '!.[upos=VERB]',
+    '!//[upos=VERB]/[deprel=obj]',
+    '.[!upos=VERB]',
+    '.[!(upos=VERB | upos=AUX)]',
+    '.[!/[deprel=nsubj]]',
+    '<[deprel=advmod !lemma=nu]',
+    '../[!deprel=root]',
+    '.[ /[deprel=obj] & !<[deprel=obj feats.PronType=Rel] ]',
+    '/[deprel=xcomp (upos=VERB & !misc.Mood=Part | /[deprel=cop,aux:pass] ) ]',
+    '.[!!upos=VERB]',
+]
+
+def shape(result):
+    if isinstance(result, list):
+        return [(id(m.node), shape(m.next_nodes)) for m in result]
+    return result
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'rrt-all.3.annot.4.jz'
+    doc = tp.ParsedDoc.from_json_zip(filename)
+    sentences = doc[:int(sys.argv[2])] if len(sys.argv) > 2 else doc
+    nodes = [n for s in sentences for n in s.node_list]
+    failed = 0
+    for e in exprs:
+        interpreted, compiled = Search(e), Search(e, backend='compiled')
+        checks = {'find':True, 'iter':True, 'exists':True, 'count':True}
+        for n in nodes:
+            r1, r2 = interpreted.find(n), compiled.find(n)
+            if type(r1) != type(r2) or shape(r1) != shape(r2):
+                checks['find'] = False
+            if shape(list(interpreted.iter(n))) != shape(list(compiled.iter(n))):
+                checks['iter'] = False
+            if interpreted.exists(n) != compiled.exists(n):
+                checks['exists'] = False
+            if interpreted.count(n) != compiled.count(n):
+                checks['count'] = False
+        bad = [k for k, ok in checks.items() if not ok]
+        failed += bool(bad)
+        print('FAIL' if bad else 'ok  ', e, ' '.join(bad))
+    print('%d of %d expressions failed' % (failed, len(exprs)))
+    sys.exit(1 if failed else 0)
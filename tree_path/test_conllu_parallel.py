@@ -0,0 +1,29 @@
+"""Checks search_conllu_files_parallel against search_conllu_files:
+python -m tree_path.test_conllu_parallel [file.conllu] [jobs]"""
+import sys
+
+import tree_path as tp
+from tree_path import MatchRecord
+
+exprs = [
+    '../[*]', # matches without a node at the root
+    '../[!deprel=root]',
+    '.[upos=VERB]/[deprel=obj]',
+    './/[upos=VERB]/[upos=PRON,NOUN]/[upos=ADP,DET]',
+    '/[deprel=nsubj] /[deprel=obj]',
+]
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'rrt.conllu'
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    failed = 0
+    for e in exprs:
+        sequential = [MatchRecord.from_match(m, m.metadata['filename'], m.metadata['sent-id'])
+                      for m in tp.search_conllu_files(e, [filename])]
+        # small pieces, so that several go to each process
+        parallel = list(tp.search_conllu_files_parallel(e, [filename], jobs, piece_bytes=1 << 20))
+        ok = parallel == sequential
+        failed += not ok
+        print('ok  ' if ok else 'FAIL', e, '%d matches' % len(parallel))
+    print('%d of %d expressions failed' % (failed, len(exprs)))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,66 @@
+"""Checks that .jz files written as a single document are streamed: python -m tree_path.test_json_zip [file.jz]
+Reading or searching the sentences one at a time must take a small part of the json size in memory,
+while a full load takes over ten times the json size"""
+import gzip
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+import tree_path as tp
+from tree_path.parsed_doc import iter_json_zip_sentences
+
+MAX_PEAK_FRACTION = 0.25 # of the uncompressed json size
+MIN_PEAK_ALLOWED = 8e6 # read buffers and signatures, for small files
+
+def json_size(filename : str) -> int:
+    size = 0
+    with gzip.open(filename, 'rb') as handle:
+        while chunk := handle.read(1 << 24):
+            size += len(chunk)
+    return size
+
+def peak_memory(fn) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'rrt-all.3.annot.4.jz'
+    with gzip.open(filename, 'rt', encoding='utf-8') as handle:
+        single = handle.read(1).lstrip() == '{'
+    temp = None
+    if not single: # a single document archive from the first document
+        doc = next(tp.DocList.iter_json_zip(filename))
+        temp = tempfile.NamedTemporaryFile(suffix='.jz', delete=False)
+        temp.close()
+        doc.to_json_zip(temp.name)
+        filename = temp.name
+    sidecar = filename + tp.SentenceSignatures.SUFFIX
+    had_sidecar = os.path.exists(sidecar)
+    try:
+        size = json_size(filename)
+        sentences = peak_memory(lambda : sum(1 for _ in iter_json_zip_sentences(filename)))
+        search = peak_memory(lambda : sum(1 for _ in tp.DocList.search_json_zip(filename, './/[upos=VERB]/[deprel=obj]')))
+        print('json %.1f MB, peak %.1f MB reading the sentences, %.1f MB searching' % (size / 1e6, sentences / 1e6, search / 1e6))
+        doc = tp.ParsedDoc.from_json_zip(filename)
+        [streamed] = list(tp.DocList.iter_json_zip(filename))
+        dump = lambda d : json.dumps(d.to_jsonable(), sort_keys=True, default=sorted)
+        checks = {
+            'sentences memory':sentences < max(size * MAX_PEAK_FRACTION, MIN_PEAK_ALLOWED),
+            'search memory':search < max(size * MAX_PEAK_FRACTION, MIN_PEAK_ALLOWED),
+            'sentences':[j['sent_id'] for j in iter_json_zip_sentences(filename)] == [s.sent_id for s in doc],
+            'document':dump(streamed) == dump(doc),
+        }
+    finally:
+        if temp is not None:
+            os.remove(temp.name)
+        if not had_sidecar and os.path.exists(sidecar): # left as it was
+            os.remove(sidecar)
+    bad = [k for k, ok in checks.items() if not ok]
+    print('FAIL ' + ', '.join(bad) if bad else 'ok')
+    sys.exit(1 if bad else 0)
@@ -0,0 +1,34 @@
+"""Checks DocList.from_conllu with jobs against the sequential load and times both:
+python -m tree_path.test_parallel_load [file.conllu] [jobs]
+The documents must be equal, and the token strings must be shared between documents loaded by different workers"""
+import json
+import os
+import sys
+import time
+
+import tree_path as tp
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def distinct(docs : tp.DocList, key : str, value : str) -> int:
+    """Number of distinct string objects equal to value under key"""
+    return len({id(n._data[key]) for d in docs for s in d for n in s.node_list if n._data[key] == value})
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'rrt.conllu'
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    sequential, t1 = timed(lambda : tp.DocList.from_conllu(filename))
+    parallel, t2 = timed(lambda : tp.DocList.from_conllu(filename, jobs=jobs))
+    print('%d documents, sequential %.2fs, %d jobs %.2fs on %d cpus' % (len(sequential), t1, jobs, t2, os.cpu_count()))
+    dump = lambda docs : json.dumps([d.to_jsonable() for d in docs], sort_keys=True, default=sorted)
+    checks = {
+        'documents':dump(parallel) == dump(sequential),
+        'shared upos':distinct(parallel, 'upos', 'NOUN') == distinct(sequential, 'upos', 'NOUN') == 1,
+        'shared deprel':distinct(parallel, 'deprel', 'nsubj') == distinct(sequential, 'deprel', 'nsubj') == 1,
+    }
+    bad = [k for k, ok in checks.items() if not ok]
+    print('FAIL ' + ', '.join(bad) if bad else 'ok')
+    sys.exit(1 if bad else 0)
@@ -1,23 +1,28 @@
 from __future__ import annotations
 
 import json
+from collections import defaultdict
 from typing import Dict, List, Iterator, Callable, Union, Any, Set, Tuple
 from pyconll.unit.sentence import Sentence
 from pyconll.unit.token import Token
 
 import pyconll
 
+from tree_path.interning import Interner, INTERNER
+
 class Sequence(List[Dict[str, Any]]):
-    def __init__(self, data_list : List[Dict[str, Any]]):#, id_tag = 'id', meta_data : Dict = None):
+    def __init__(self, data_list : List[Dict[str, Any]], is_sorted : bool = False):#, id_tag = 'id', meta_data : Dict = None):
+        """If not is_sorted, tokens are sorted by id"""
         super().__init__(data_list)
-        self.sort(key=lambda tok : float(tok['id']))
+        if not is_sorted:
+            self.sort(key=lambda tok : float(tok['id']))
     def before(self, id : str) -> Sequence:
         before_list = []
         for tok in self:
             if str(tok['id']) == id:
                 break
             before_list.append(tok)
-        return Sequence(before_list)
+        return Sequence(before_list, True)
     def after(self, id : str) -> Sequence:
         after_list = []
         after_flag = False
@@ -27,7 +32,7 @@ class Sequence(List[Dict[str, Any]]):
                 continue
             if after_flag:
                 after_list.append(tok)
-        return Sequence(after_list)
+        return Sequence(after_list, True)
     def id_index(self, id : str) -> int:
         for tok, i in zip(self, range(0, len(self))):
             if tok['id'] == id:
@@ -37,7 +42,7 @@ class Sequence(List[Dict[str, Any]]):
 def _sets2lists(d : Dict) -> Dict:
     d2 = {}
     for k,v in d.items():
-        if isinstance(v, set):
+        if isinstance(v, (set, frozenset)):
             d2[k] = list(v)
         elif isinstance(v, dict):
             d2[k] = _sets2lists(v)
@@ -57,12 +62,79 @@ def _lists2sets(d : Dict) -> Dict:
     return d2
 
 
+def _sort_nodes(nodes : List[Tree]) -> List[Tree]:
+    """Sorts nodes in sentence order, by position if all have one, otherwise by id"""
+    if all(n._position is not None for n in nodes):
+        nodes.sort(key=lambda n : n._position)
+    else:
+        nodes.sort(key=lambda n : float(n._data['id']))
+    return nodes
+
+class _PreorderIndex:
+    """Preorder array of a tree. The subtree of node is nodes[node._pre_enter:node._pre_exit]"""
+    def __init__(self, root : Tree):
+        self.valid = True
+        self.nodes : List[Tree] = []
+        self.depths : List[int] = [] # by preorder index
+        stack = [(root, len(root.ancestors()) - 1)]
+        while stack:
+            node, depth = stack.pop()
+            node._preorder = self
+            node._pre_enter = len(self.nodes)
+            self.nodes.append(node)
+            self.depths.append(depth)
+            stack.extend((c, depth + 1) for c in reversed(node._children))
+        for node in reversed(self.nodes): # descendants come after their ancestor
+            node._pre_exit = node._pre_enter + 1 + sum(c._pre_exit - c._pre_enter for c in node._children)
+        self._euler : List[int]|None = None
+    def _make_lca_table(self):
+        """Euler tour of the tree (as preorder indexes) and a sparse table of its minimum depths"""
+        self._euler = euler = []
+        self._first = first = [0] * len(self.nodes)
+        stack = [(self.nodes[0], 0)]
+        while stack:
+            node, i = stack[-1]
+            if i == 0:
+                first[node._pre_enter] = len(euler)
+            euler.append(node._pre_enter)
+            if i < len(node._children):
+                stack[-1] = (node, i + 1)
+                stack.append((node._children[i], 0))
+            else:
+                stack.pop()
+        depths = self.depths
+        self._sparse = sparse = [euler]
+        span = 1
+        while 2 * span <= len(euler):
+            prev = sparse[-1]
+            sparse.append([a if depths[a] <= depths[b] else b
+                           for a, b in zip(prev, prev[span:])])
+            span *= 2
+    def lca(self, n1 : Tree, n2 : Tree) -> Tree:
+        if self._euler is None:
+            self._make_lca_table()
+        i, j = self._first[n1._pre_enter], self._first[n2._pre_enter]
+        if i > j:
+            i, j = j, i
+        level = (j - i + 1).bit_length() - 1
+        row = self._sparse[level]
+        a, b = row[i], row[j - (1 << level) + 1]
+        return self.nodes[a if self.depths[a] <= self.depths[b] else b]
+
 class Tree:
+    INDEXED_KEYS = ('deprel', 'upos')
+    __slots__ = ('_data', 'parent', '_children', 'str_from_conllu', '_child_index',
+                 '_preorder', '_pre_enter', '_pre_exit', '_position')
     def __init__(self, data : Dict[str, Dict|str], parent : Tree|None, children : List[Tree]):
         self._data = data
         self.parent = parent
         self._children = children
-        self.str_from_conllu = True 
+        self.str_from_conllu = True
+        self._child_index : Dict[str, Dict[str|frozenset, List[Tree]]]|None = None
+        self._preorder : _PreorderIndex|None = None
+        self._pre_enter = 0
+        self._pre_exit = 0
+        self._position : int|None = None # linear position in sentence, assigned by ParsedSentence
     def data(self, path:str|List[str] = None) -> str|Dict|Set|None:
         if not path:
             return self._data
@@ -79,7 +151,7 @@ class Tree:
         """data(path) as string. Sets, lists, tuples are returned joined by ',' """
         data = self.data(path)
         if not data: return ''
-        if isinstance(data, (Set, List, Tuple)):
+        if isinstance(data, (set, frozenset, list, tuple)):
             return ','.join(data)
         return str(data)
         
@@ -98,11 +170,18 @@ class Tree:
         key = path[-1]
         return d, key
 
+    def _invalidate_parent_index(self, path:str|List[str]):
+        if self.parent is None: return
+        key = path.split('.', 1)[0] if isinstance(path, str) else path[0]
+        if key in Tree.INDEXED_KEYS:
+            self.parent._child_index = None
+
     def assign(self, path: str | List[str], value: str | Set, create_if_absent : bool = True) -> bool:
         d, key = self._path_to_dict_and_key(path, create_if_absent)
         if d is None: return False
         if key in d or create_if_absent:
             d[key] = value
+            self._invalidate_parent_index(path)
             return True
         return False
     def remove(self, path: str | List[str]) -> bool:
@@ -110,19 +189,83 @@ class Tree:
         if d is None: return False
         if key in d:
             d.pop(key)
+            self._invalidate_parent_index(path)
             return True
         return False
 
                 
     def children_tokens(self) -> Sequence:
-        return Sequence([t._data for t in self._children])
+        return Sequence([t._data for t in _sort_nodes(list(self._children))], True)
     def children(self) -> List[Tree]:
         return list(self._children)
+    def add_child(self, child : Tree):
+        if isinstance(self._children, tuple):
+            raise Exception('Cannot add children to a frozen tree')
+        child.parent = self
+        self._children.append(child)
+        self._child_index = None
+        if self._preorder is not None:
+            self._preorder.valid = False
+    def children_with(self, key : str, values : Set[str]) -> Tuple[Tree, ...]:
+        """Children whose value at key (one of INDEXED_KEYS) is among values, in order, as a tuple.
+        Uses an index built on first call and dropped by add_child, assign and remove;
+        changes made directly to _children or _data are not seen by it"""
+        if not self._children:
+            return ()
+        if self._child_index is None:
+            self._child_index = {}
+        index = self._child_index.get(key)
+        if index is None:
+            index = defaultdict(list)
+            for child in self._children:
+                value = child._data.get(key)
+                if isinstance(value, str):
+                    index[value].append(child)
+                elif isinstance(value, (set, frozenset)):
+                    for v in value:
+                        index[v].append(child)
+            index = self._child_index[key] = {v:tuple(children) for v, children in index.items()}
+        if len(values) == 1:
+            for value in values:
+                return index.get(value, ())
+        values = frozenset(values)
+        found = index.get(values)
+        if found is None: # several values, cache the merged list under the value set
+            found = tuple(c for c in self._children if any(c in index.get(v, ()) for v in values))
+            index[values] = found
+        return found
+    def freeze(self):
+        """Stores the children of every node under self as tuples, the childless sharing the empty tuple.
+        The structure can no longer change through add_child"""
+        for node in self.traverse():
+            node._children = tuple(node._children)
+    def is_frozen(self) -> bool:
+        return isinstance(self._children, tuple)
+    def make_preorder_index(self):
+        """Stores the preorder of the tree under self, so that traverse, descendants and has_ancestor
+        become array slices and interval checks. Dropped by add_child anywhere in the tree"""
+        _PreorderIndex(self)
+    def _indexed(self) -> bool:
+        return self._preorder is not None and self._preorder.valid
     def traverse(self) -> Iterator[Tree]:
+        if self._indexed():
+            return iter(self._preorder.nodes[self._pre_enter:self._pre_exit])
+        return self._traverse()
+    def _traverse(self) -> Iterator[Tree]:
         yield self
         for child in self._children:
             for node in child.traverse():
                 yield node
+    def descendants(self) -> List[Tree]:
+        """All nodes under self, in preorder, self excluded"""
+        if self._indexed():
+            return self._preorder.nodes[self._pre_enter+1:self._pre_exit]
+        return list(self._traverse())[1:]
+    def has_ancestor(self, node : Tree) -> bool:
+        """Same as node in self.ancestors()"""
+        if self._indexed() and node._preorder is self._preorder:
+            return node._pre_enter <= self._pre_enter < node._pre_exit
+        return node in self.ancestors()
     def search(self, filter : Callable[[Tree], bool]) -> List[Tree]:
         return [n for n in self.traverse() if filter(n)]
     def ancestors(self) -> List[Tree]:
@@ -133,20 +276,27 @@ class Tree:
             node = node.parent
         return ancestors
     def depth(self) -> int:
+        if self._indexed():
+            return self._preorder.depths[self._pre_enter]
         return len(self.ancestors()) - 1
+    def common_ancestor(self, other : Tree) -> Tree|None:
+        """Lowest node that is an ancestor of (or is) both self and other, None if in different trees"""
+        if self._indexed() and other._preorder is self._preorder:
+            return self._preorder.lca(self, other)
+        other_ancestors = set(other.ancestors())
+        for a in self.ancestors():
+            if a in other_ancestors:
+                return a
+        return None
     def root(self) -> Tree:
         r = self
         while r.parent:
             r = r.parent
         return r
     def projection(self) -> Sequence:
-        tok_list = [n._data for n in self.traverse()]
-        tok_list.sort(key=lambda tok : float(tok['id']))
-        return Sequence(tok_list)
+        return Sequence([n._data for n in self.projection_nodes()], True)
     def projection_nodes(self) -> List[Tree]:
-        node_list = [n for n in self.traverse()]
-        node_list.sort(key=lambda n : float(n.data('id')))
-        return node_list
+        return _sort_nodes(list(self.traverse()))
     def __str__(self):
         if self.str_from_conllu and self._data and 'id' in self._data and 'form' in self._data:
             return '(%s) %s' % (str(self._data['id']), str(self._data['form']))
@@ -158,12 +308,11 @@ class Tree:
                      'children':[c.to_jsonable() for c in self.children()]}
         return json_dict
     @staticmethod
-    def from_jsonable(json_dict : Dict) -> Tree:
-        data = _lists2sets(json_dict['_data'])
+    def from_jsonable(json_dict : Dict, interner : Interner|None = INTERNER) -> Tree:
+        """Token strings and feature values are shared through interner, unless it is None"""
+        data = interner.token(json_dict['_data']) if interner is not None else _lists2sets(json_dict['_data'])
         node = Tree(data, None, [])
         for child_data in json_dict['children']:
-            child = Tree.from_jsonable(child_data)
-            child.parent = node
-            node._children.append(child)
+            node.add_child(Tree.from_jsonable(child_data, interner))
         return node
     
@@ -28,7 +28,7 @@ def create_present_absent_deprels(valence_row : dict) -> (List[str], List[str],
     return present, absent
 
 import tree_path as tp
-from tree_path import Search, Tree
+from tree_path import Search, Tree, SearchSet
 
 
 def vdf_string_to_search(src : str) -> Search:
@@ -68,6 +68,13 @@ class DeprelValence:
         self.absent_repr = absent_deprels
         self._test_dict = {True:self.present_deprels, False:self.absent_deprels}
         self.ellide = ellide
+    def tests(self) -> List[Search]:
+        """Present then absent tests, in the order matches_results expects their results"""
+        return self.present_deprels + self.absent_deprels
+    def matches_results(self, results : List[bool]) -> bool:
+        """Same as matches, given the exists() results of tests() on the node"""
+        n_present = len(self.present_deprels)
+        return all(results[:n_present]) and not any(results[n_present:])
     def matches(self, node : Tree) -> bool:
         # if node is an infinitive complement of _putea_, we need to add _putea_'s complements to it
         # ie "îi pot da ceva" -- îi is the iobj of _da_, but is parsed as depending on _pot_
@@ -113,10 +120,19 @@ for k,v in ev_dict.items():
     lemma_valence_dict[v['Lemma']].append(DeprelValence.from_valence_df_dict(v))
 
 lemma_valence_dict : Dict[str, List[DeprelValence]] = dict(lemma_valence_dict)
+# the tests of all valences of a lemma, evaluated in one pass; tests repeated between valences are run once
+lemma_test_dict : Dict[str, SearchSet] = {lemma:SearchSet([t for v in vals for t in v.tests()])
+                                          for lemma, vals in lemma_valence_dict.items()}
 
 def get_matching_valences(node : Tree) -> List[DeprelValence]:
     full_lemma = str(valences.get_verb_lemma(node))
     if full_lemma not in lemma_valence_dict:
         return []
-    vals = [dep_val for dep_val in lemma_valence_dict[full_lemma] if dep_val.matches(node)]
+    results = lemma_test_dict[full_lemma].exists(DeprelValence.modal_verb_pass_complements(node))
+    vals = []
+    for dep_val in lemma_valence_dict[full_lemma]:
+        n_tests = len(dep_val.present_deprels) + len(dep_val.absent_deprels)
+        if dep_val.matches_results(results[:n_tests]):
+            vals.append(dep_val)
+        results = results[n_tests:]
     return vals